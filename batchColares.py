@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+""" Solve many PuzzleColares instances in one run.
+
+Instances are read one per line, as JSON, from a file or standard input:
+either a listifyed() configuration or an object {"id": ..., "state": ...}
+holding one. They are solved in a pool of processes with the chosen searcher
+and the results are written, one JSON object per line, as soon as each one
+finishes (so not necessarily in input order):
+
+    {"id": ..., "status": "solved", "actions": [...], "cost": ...,
+     "expanded": ..., "generated": ..., "time": ...}
+
+status is "solved", "unsolvable" (the searcher returned None), "budget" (the
+time or node limit was reached) or "error". expanded and generated count the
+calls to actions and result, as in InstrumentedProblem; searchers that work
+on packed states internally (bidirectional_breadth_first_search and the
+like) add the states they expand and generate to the same counters (see
+Problem.count), where the node limit is checked too; rebuilding their
+solution is not counted. parallel_breadth_first_search cannot be used, as
+it starts processes of its own, which the pool's workers may not do.
+
+    python batchColares.py scrambles.jsonl -o results.jsonl \\
+        --searcher astar_search --workers 32 --time-limit 10
+"""
+
+import argparse
+import json
+import multiprocessing
+import signal
+import sys
+import time
+import puzzleColares
+from puzzleColares import *
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class BudgetedProblem(InstrumentedProblem):
+
+    """ InstrumentedProblem that raises BudgetExceeded rather than generate
+        more than maxNodes states """
+    def __init__(self, problem, maxNodes=None):
+        super().__init__(problem)
+        self.maxNodes = maxNodes
+
+    def _checkBudget(self, generated=1):
+        if self.maxNodes and self.states + generated > self.maxNodes:
+            raise BudgetExceeded()
+
+    def result(self, state, action):
+        self._checkBudget()
+        return super().result(state, action)
+
+    def count(self, expanded, generated):
+        self._checkBudget(generated)
+        super().count(expanded, generated)
+
+
+def _onAlarm(signum, frame):
+    raise BudgetExceeded()
+
+
+_settings = {}
+
+def _initWorker(searcher, timeLimit, nodeLimit):
+    _settings['searcher'] = getattr(puzzleColares, searcher)
+    _settings['timeLimit'] = timeLimit
+    _settings['nodeLimit'] = nodeLimit
+    if timeLimit and hasattr(signal, 'setitimer'):
+        signal.signal(signal.SIGALRM, _onAlarm)
+
+
+def solveInstance(line):
+    """ Solve the instance on one input line (line number, text) and return
+        its result as a dictionary """
+    number, text = line
+    result = {'id': number}
+    start = time.time()
+    problem = None
+    try:
+        instance = json.loads(text)
+        if isinstance(instance, dict):
+            result['id'] = instance.get('id', number)
+            instance = instance['state']
+        state = IntersectedNecklacesState(dimension=len(instance), numBeads=len(instance[0]), initConf=instance)
+        problem = BudgetedProblem(PuzzleColares(state), _settings['nodeLimit'])
+        timeLimit = _settings['timeLimit']
+        if timeLimit and hasattr(signal, 'setitimer'):
+            signal.setitimer(signal.ITIMER_REAL, timeLimit)
+        try:
+            node = _settings['searcher'](problem)
+        finally:
+            if timeLimit and hasattr(signal, 'setitimer'):
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        if node == None:
+            result['status'] = 'unsolvable'
+        else:
+            result['status'] = 'solved'
+            result['actions'] = [[a['target'], a['direction']] for a in node.solution()]
+            result['cost'] = node.path_cost
+    except BudgetExceeded:
+        result['status'] = 'budget'
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+    if problem != None:
+        result['expanded'] = problem.succs
+        result['generated'] = problem.states
+    result['time'] = time.time() - start
+    return result
+
+
+def _readInstances(f):
+    for number, text in enumerate(f):
+        if text.strip():
+            yield number, text
+
+
+def solveBatch(source, sink, searcher='bidirectional_breadth_first_search', \
+               workers=None, timeLimit=None, nodeLimit=None):
+    """ Solve every instance read from the file source, writing the results
+        to the file sink as they finish. Returns the number of instances. """
+    count = 0
+    with multiprocessing.Pool(workers, _initWorker, (searcher, timeLimit, nodeLimit)) as pool:
+        for result in pool.imap_unordered(solveInstance, _readInstances(source)):
+            sink.write(json.dumps(result) + "\n")
+            sink.flush()
+            count += 1
+    return count
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve PuzzleColares instances from a JSONL stream")
+    parser.add_argument('input', nargs='?', default='-', help="instances file (default: standard input)")
+    parser.add_argument('-o', '--output', default='-', help="results file (default: standard output)")
+    parser.add_argument('--searcher', default='bidirectional_breadth_first_search',
+                        help="search function of puzzleColares or searchPlus")
+    parser.add_argument('--workers', type=int, default=None, help="processes (default: one per core)")
+    parser.add_argument('--time-limit', type=float, default=None, help="seconds per instance")
+    parser.add_argument('--node-limit', type=int, default=None, help="generated nodes per instance")
+    args = parser.parse_args()
+
+    if not callable(getattr(puzzleColares, args.searcher, None)):
+        parser.error("unknown searcher: "+args.searcher)
+    if args.searcher == 'parallel_breadth_first_search':
+        parser.error("parallel_breadth_first_search starts its own processes and cannot run in the pool")
+    source = sys.stdin if args.input == '-' else open(args.input)
+    sink = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        solveBatch(source, sink, args.searcher, args.workers, args.time_limit, args.node_limit)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+""" Scaling benchmark for the PuzzleColares searchers.
+
+For every combination of dimension, number of beads and scramble depth a
+seeded set of instances is generated (states whose optimal solution has
+exactly that many moves, from ScrambleGenerator), and each searcher solves
+them. For every searcher and
+combination the report records the nodes expanded and generated (calls to
+actions and result, or the counts the searchers on packed states add to the
+same counters), the states generated per second, the peak memory
+allocated during the search (tracemalloc, measured in a separate run so it
+does not slow the timed ones) and the wall time. Each search is timed
+repeats times and the fastest run counts, as millisecond runs vary a lot
+from one to the next. A searcher that raises (a puzzle too large for its
+visited array, NumPy missing, ...) has the failure counted in the row's
+errors and the grid goes on.
+
+The report is written as JSON. Given a baseline report, the results are
+also compared with it, so a change to rotateColours or result can be
+checked for speed regressions. Combinations whose total time is below
+--min-time in either report are not judged faster or slower:
+
+    python benchColares.py --report before.json
+    ... change the code ...
+    python benchColares.py --report after.json --baseline before.json
+"""
+
+import argparse
+import json
+import signal
+import time
+import tracemalloc
+import puzzleColares
+from puzzleColares import *
+from batchColares import BudgetExceeded, BudgetedProblem
+from scrambleColares import ScrambleGenerator
+
+
+DEFAULT_SEARCHERS = ['breadth_first_search', 'astar_search', 'bidirectional_breadth_first_search']
+
+
+def scrambledInstances(dimension, numBeads, depth, count, seed):
+    """ count states at exactly depth moves from the nearest goal state """
+    puzzle = PuzzleColares(IntersectedNecklacesState(dimension=dimension, numBeads=numBeads))
+    topology = puzzle.initial.getTopology()
+    return [IntersectedNecklacesState(dimension=dimension, numBeads=numBeads, initConf=topology.listify(packed))
+            for packed in ScrambleGenerator(puzzle, depth, seed).generate(count)]
+
+
+def _onAlarm(signum, frame):
+    raise BudgetExceeded()
+
+
+def runSearcher(searcher, state, timeLimit=None, nodeLimit=None, memory=False):
+    """ Solve state with searcher; return a dictionary of measurements """
+    problem = BudgetedProblem(PuzzleColares(state), nodeLimit)
+    useAlarm = timeLimit and hasattr(signal, 'setitimer')
+    if useAlarm:
+        signal.signal(signal.SIGALRM, _onAlarm)
+        signal.setitimer(signal.ITIMER_REAL, timeLimit)
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    error = None
+    try:
+        node = searcher(problem)
+        status = 'solved' if node != None else 'unsolvable'
+    except BudgetExceeded:
+        node = None
+        status = 'budget'
+    except Exception as e:
+        node = None
+        status = 'error'
+        error = str(e)
+    finally:
+        elapsed = time.perf_counter() - start
+        if useAlarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        peak = 0
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    run = {'status': status,
+           'cost': node.path_cost if node != None else None,
+           'expanded': problem.succs,
+           'generated': problem.states,
+           'time': elapsed,
+           'peakMemory': peak}
+    if error != None:
+        run['error'] = error
+    return run
+
+
+def benchmark(searchers, dimensions, beads, depths, instances=3, seed=0, \
+              timeLimit=None, nodeLimit=None, memory=True, repeats=3):
+    """ Run the benchmark grid and return the list of result rows. The time
+        of each instance is the best of repeats runs. A search that raises
+        is counted in the row's errors (with its message in error) and is
+        not repeated, so the rest of the grid still runs. """
+    rows = []
+    for dimension in dimensions:
+        for numBeads in beads:
+            for depth in depths:
+                states = scrambledInstances(dimension, numBeads, depth, instances, seed)
+                for name in searchers:
+                    searcher = getattr(puzzleColares, name)
+                    row = {'searcher': name, 'dimension': dimension, 'numBeads': numBeads,
+                           'depth': depth, 'instances': len(states), 'solved': 0, 'errors': 0,
+                           'expanded': 0, 'generated': 0, 'time': 0.0, 'peakMemory': 0}
+                    for state in states:
+                        run = runSearcher(searcher, state, timeLimit, nodeLimit)
+                        if run['status'] == 'error':
+                            row['errors'] += 1
+                            row['error'] = run['error']
+                            continue
+                        runs = [run] + [runSearcher(searcher, state, timeLimit, nodeLimit) for k in range(1, repeats)]
+                        run = min(runs, key=lambda run: run['time'])
+                        row['solved'] += run['status'] == 'solved'
+                        row['expanded'] += run['expanded']
+                        row['generated'] += run['generated']
+                        row['time'] += run['time']
+                        if memory:
+                            run = runSearcher(searcher, state, timeLimit, nodeLimit, memory=True)
+                            row['peakMemory'] = max(row['peakMemory'], run['peakMemory'])
+                    row['statesPerSecond'] = row['generated'] / row['time'] if row['time'] > 0 else None
+                    rows.append(row)
+    return rows
+
+
+def _rowKey(row):
+    return (row['searcher'], row['dimension'], row['numBeads'], row['depth'])
+
+
+def compare(rows, baseline, tolerance=0.1, minTime=0.05):
+    """ Rows of [searcher, dimension, beads, depth, time ratio, generated
+        ratio, verdict] comparing rows with the baseline rows. The verdict
+        is 'errors' when either row has searches that raised, and 'too
+        short' when either time is below minTime seconds. """
+    previous = {_rowKey(row): row for row in baseline}
+    table = []
+    for row in rows:
+        old = previous.get(_rowKey(row))
+        if old == None:
+            continue
+        timeRatio = row['time'] / old['time'] if old['time'] > 0 else 1.0
+        nodeRatio = row['generated'] / old['generated'] if old['generated'] > 0 else 1.0
+        if row.get('errors', 0) or old.get('errors', 0):
+            verdict = 'errors'
+        elif row['time'] < minTime or old['time'] < minTime:
+            verdict = 'too short'
+        elif timeRatio > 1 + tolerance:
+            verdict = 'slower'
+        elif timeRatio < 1 - tolerance:
+            verdict = 'faster'
+        else:
+            verdict = 'same'
+        table.append([row['searcher'], row['dimension'], row['numBeads'], row['depth'],
+                      round(timeRatio, 3), round(nodeRatio, 3), verdict])
+    return table
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the PuzzleColares searchers")
+    parser.add_argument('--searchers', nargs='+', default=DEFAULT_SEARCHERS)
+    parser.add_argument('--dimensions', type=int, nargs='+', default=[2, 3])
+    parser.add_argument('--beads', type=int, nargs='+', default=[12, 20])
+    parser.add_argument('--depths', type=int, nargs='+', default=[4, 6])
+    parser.add_argument('--instances', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--time-limit', type=float, default=30, help="seconds per search")
+    parser.add_argument('--node-limit', type=int, default=None, help="generated nodes per search")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc runs")
+    parser.add_argument('--repeats', type=int, default=3, help="timed runs per instance, the fastest counts")
+    parser.add_argument('--report', default='bench_report.json')
+    parser.add_argument('--baseline', default=None, help="earlier report to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="time ratio counted as unchanged")
+    parser.add_argument('--min-time', type=float, default=0.05, help="seconds below which times are not compared")
+    args = parser.parse_args()
+
+    rows = benchmark(args.searchers, args.dimensions, args.beads, args.depths, args.instances,
+                     args.seed, args.time_limit, args.node_limit, not args.no_memory, args.repeats)
+    report = {'settings': vars(args), 'results': rows}
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    print_table([[row['searcher'], row['dimension'], row['numBeads'], row['depth'],
+                  str(row['solved'])+'/'+str(row['instances']), row['errors'], row['expanded'], row['generated'],
+                  round(row['time'], 3), row['statesPerSecond'] and round(row['statesPerSecond']),
+                  row['peakMemory']] for row in rows],
+                header=['searcher', 'dim', 'beads', 'depth', 'solved', 'errors', 'expanded', 'generated',
+                        'time', 'states/s', 'peak bytes'])
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        print()
+        print_table(compare(rows, baseline, args.tolerance, args.min_time),
+                    header=['searcher', 'dim', 'beads', 'depth', 'time ratio', 'generated ratio', ''])
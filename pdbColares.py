@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+
+""" Pattern databases for PuzzleColares.
+
+A pattern database keeps only some colours of the puzzle (the others become
+colour 0, "any colour") and stores, for every arrangement of the kept
+colours, its distance to the nearest abstracted goal state. Every move of the
+puzzle is a move of the abstraction, so that distance never overestimates
+the real one and PatternDatabase.h is an admissible heuristic for
+astar_search and recursive_best_first_search.
+
+Distances are found with a breadth-first search from all goal states (every
+rotation is undone by the opposite one, so searching forward from the goals
+is searching backward to them) and written, one byte per arrangement
+in MultisetRanker order, to a file that PatternDatabase memory-maps. Many
+solver processes can then share one copy of the table.
+
+The table has one entry per arrangement of the kept colours over all the
+unique beads, so keep few colours on large puzzles: keeping one colour of
+a 2 x 12 puzzle is 74613 entries, of a 2 x 20 puzzle 163011640.
+
+Keeping every colour gives a distance table for the whole puzzle, stored at
+4 bits per state by buildDistanceTable and used by DistanceTable to solve any
+instance by greedy descent. It has PuzzleColares.numStates() entries, which
+is only practical for small puzzles (4204200 states for 2 x 8, but about
+1.5e11 for 2 x 12 and 3e20 for 2 x 20).
+"""
+
+import argparse
+import json
+import mmap
+import struct
+from puzzleColares import *
+
+_MAGIC = b'PDBC'
+_UNREACHED = 255
+
+
+def abstractionTable(colours):
+    """ bytes.translate table keeping colours and turning the rest into 0 """
+    table = bytearray(256)
+    for c in colours:
+        table[c] = c
+    return bytes(table)
+
+
+def _abstractCounts(cdist, colours):
+    counts = {c: cdist[c] for c in colours}
+    others = sum(cdist[c] for c in cdist if c not in colours)
+    if others > 0:
+        counts[0] = others
+    return counts
+
+
+def _checkCounts(packed, counts):
+    """ Raise unless packed has counts[c] beads of each colour c (and no
+        others), as the table was built for """
+    if len(packed) != sum(counts.values()) or any(packed.count(c) != n for c, n in counts.items()):
+        raise Exception("State colour distribution does not match the table's: "+str(counts))
+
+
+def _writeTable(path, header, data):
+    header = json.dumps(header).encode()
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<4sI', _MAGIC, len(header)))
+        f.write(header)
+        f.write(data)
+
+
+def _openTable(path, kind):
+    """ Return (header, mmap, offset of the data) of a table file """
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, size = struct.unpack_from('<4sI', data)
+    if magic != _MAGIC:
+        raise Exception("Not a pattern database: "+str(path))
+    offset = struct.calcsize('<4sI')
+    header = json.loads(data[offset:offset+size].decode())
+    if header['kind'] != kind:
+        raise Exception("Not a "+kind+" table: "+str(path))
+    return header, data, offset + size
+
+
+def buildPatternDatabase(problem, colours, path):
+    """ Build the pattern database of problem (a PuzzleColares) keeping the
+        given colours, write it to path and return the largest distance. """
+    initial = problem.initial
+    topology = initial.getTopology()
+    cdist = initial.getColourDistribution()
+    table = abstractionTable(colours)
+    counts = _abstractCounts(cdist, colours)
+    ranker = MultisetRanker(counts)
+    moves = [(a['target'], a['direction']) for a in problem.actions(initial)]
+
+    distances = bytearray([_UNREACHED]) * ranker.getSize()
+    frontier = []
+    for goal in topology.goalStates(cdist):
+        abstract = goal.translate(table)
+        r = ranker.rank(abstract)
+        if distances[r] == _UNREACHED:
+            distances[r] = 0
+            frontier.append(abstract)
+
+    depth = 0
+    while frontier:
+        depth += 1
+        if depth == _UNREACHED:
+            raise Exception("Distances do not fit in a byte")
+        nextFrontier = []
+        for abstract in frontier:
+            for i, d in moves:
+                child = topology.rotate(abstract, i, d)
+                r = ranker.rank(child)
+                if distances[r] == _UNREACHED:
+                    distances[r] = depth
+                    nextFrontier.append(child)
+        frontier = nextFrontier
+
+    header = {'kind': 'pattern',
+              'dimension': topology.getDimension(),
+              'numBeads': topology.getNumBeads(),
+              'colours': list(colours),
+              'counts': sorted(counts.items())}
+    _writeTable(path, header, distances)
+    return depth - 1
+
+
+class PatternDatabase(object):
+
+    """ Memory-mapped pattern database written by buildPatternDatabase """
+    def __init__(self, path):
+        header, self._data, self._offset = _openTable(path, 'pattern')
+        self._dimension = header['dimension']
+        self._numBeads = header['numBeads']
+        self._colours = header['colours']
+        self._table = abstractionTable(self._colours)
+        self._counts = dict(header['counts'])
+        self._ranker = MultisetRanker(self._counts)
+
+
+    def getColours(self):
+        return self._colours
+
+
+    def distance(self, state):
+        """ Distance from the abstraction of state to an abstract goal.
+            Raises an exception if state has other colour counts than the
+            puzzle the database was built for. """
+        abstract = state.getPacked().translate(self._table)
+        _checkCounts(abstract, self._counts)
+        d = self._data[self._offset + self._ranker.rank(abstract)]
+        if d == _UNREACHED:
+            return infinity
+        return d
+
+
+    def h(self, node):
+        return self.distance(node.state)
+
+
+    def close(self):
+        self._data.close()
+
+
+
+def buildDistanceTable(problem, path):
+    """ Write to path the distance to a goal of every state of problem (a
+        PuzzleColares), found by a breadth-first search from all goal states.
+        Each state takes 4 bits, holding its distance modulo 15 (15 marks
+        states that cannot reach a goal). Returns the largest distance. """
+    initial = problem.initial
+    topology = initial.getTopology()
+    ranker = problem.getRanker()
+    moves = [(a['target'], a['direction']) for a in problem.actions(initial)]
+
+    distances = bytearray(b'\xff') * ((ranker.getSize() + 1) // 2)
+    def unreached(r):
+        return (distances[r >> 1] >> ((r & 1) << 2)) & 15 == 15
+    def store(r, d):
+        shift = (r & 1) << 2
+        distances[r >> 1] &= ~(15 << shift) & 255
+        distances[r >> 1] |= (d % 15) << shift
+
+    frontier = []
+    for goal in topology.goalStates(initial.getColourDistribution()):
+        store(ranker.rank(goal), 0)
+        frontier.append(goal)
+    depth = 0
+    while frontier:
+        depth += 1
+        nextFrontier = []
+        for packed in frontier:
+            for i, d in moves:
+                child = topology.rotate(packed, i, d)
+                r = ranker.rank(child)
+                if unreached(r):
+                    store(r, depth)
+                    nextFrontier.append(child)
+        frontier = nextFrontier
+
+    header = {'kind': 'distance',
+              'dimension': topology.getDimension(),
+              'numBeads': topology.getNumBeads(),
+              'counts': sorted(initial.getColourDistribution().items())}
+    _writeTable(path, header, distances)
+    return depth - 1
+
+
+class DistanceTable(object):
+
+    """ Memory-mapped distance table written by buildDistanceTable. The
+        neighbours of a state at distance d are at d-1, d or d+1, which are
+        different modulo 15, so the neighbour one step closer to a goal is
+        always recognisable and solving is a greedy descent. """
+    def __init__(self, path):
+        header, self._data, self._offset = _openTable(path, 'distance')
+        self._dimension = header['dimension']
+        self._numBeads = header['numBeads']
+        self._counts = dict(header['counts'])
+        self._ranker = MultisetRanker(self._counts)
+        self._topology = getNecklaceTopology(self._dimension, self._numBeads)
+
+
+    def _lookup(self, packed):
+        r = self._ranker.rank(packed)
+        return (self._data[self._offset + (r >> 1)] >> ((r & 1) << 2)) & 15
+
+
+    def _descend(self, packed, moves):
+        """ Indices in moves of a shortest path from packed to a goal, or
+            None if no goal can be reached. Raises an exception if packed
+            has other colour counts than the puzzle of the table. """
+        _checkCounts(packed, self._counts)
+        d = self._lookup(packed)
+        if d == 15:
+            return None
+        path = []
+        while not self._isGoal(packed, d):
+            closer = (d - 1) % 15
+            for a, (i, k) in enumerate(moves):
+                child = self._topology.rotate(packed, i, k)
+                if self._lookup(child) == closer:
+                    break
+            path.append(a)
+            packed = child
+            d = closer
+        return path
+
+
+    def _isGoal(self, packed, d):
+        # distance 0 and 15 both read as 0 modulo 15: a goal has no
+        # neighbour at distance 14
+        if d != 0:
+            return False
+        for i in range(self._dimension):
+            for k in (1, -1):
+                if self._lookup(self._topology.rotate(packed, i, k)) == 14:
+                    return False
+        return True
+
+
+    def distance(self, state):
+        """ Exact number of moves from state to a goal (infinity if none) """
+        moves = [(i, k) for i in range(self._dimension) for k in (1, -1)]
+        path = self._descend(state.getPacked(), moves)
+        if path == None:
+            return infinity
+        return len(path)
+
+
+    def h(self, node):
+        return self.distance(node.state)
+
+
+    def solve(self, problem):
+        """ Goal Node of a shortest solution of problem, or None """
+        node = Node(problem.initial)
+        actions = problem.actions(problem.initial)
+        path = self._descend(problem.initial.getPacked(), [(a['target'], a['direction']) for a in actions])
+        if path == None:
+            return None
+        for a in path:
+            node = node.child_node(problem, actions[a])
+        return node
+
+
+    def close(self):
+        self._data.close()
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a PuzzleColares pattern database or distance table")
+    parser.add_argument('path', help="output file")
+    parser.add_argument('--dimension', type=int, default=2)
+    parser.add_argument('--beads', type=int, default=12)
+    parser.add_argument('--colours', type=int, nargs='+', default=[1])
+    parser.add_argument('--distances', action='store_true',
+                        help="build the full distance table instead (ignores --colours)")
+    args = parser.parse_args()
+
+    puzzle = PuzzleColares(IntersectedNecklacesState(dimension=args.dimension, numBeads=args.beads))
+    if args.distances:
+        depth = buildDistanceTable(puzzle, args.path)
+        print("Distance table written to "+args.path+", maximum distance "+str(depth))
+    else:
+        depth = buildPatternDatabase(puzzle, args.colours, args.path)
+        print("Pattern database written to "+args.path+", maximum distance "+str(depth))
@@ -1,21 +1,110 @@
 # -*- coding: utf-8 -*-
 
+import array
+import math
+import multiprocessing
+import operator
 import random
+import sys
+import zlib
 from searchPlus import *
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# text drawing of a bead of each colour code: ANSI coloured, or plain
+_ANSI_BEADS = ["\u001b[38;5;"+str(c)+"mO\u001b[0m" for c in range(256)]
+_PLAIN_BEADS = list("0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ") + ["#"] * (256-62)
+
+class ColourBuffer(object):
+
+    """ Colour bytes viewed by necklaces and beads. Every view holds the
+        ColourBuffer, not the bytes, so that when a necklace takes a bead of
+        another buffer (see Necklace._slotOf) its buffer can be merged into
+        that one: the colours are appended there and this holder is pointed
+        at them, at offset, and all its views follow. """
+    __slots__ = ('_colours', '_target', '_offset')
+
+    def __init__(self, colours):
+        self._colours = colours
+        self._target = None
+        self._offset = 0
+
+    def resolve(self):
+        """ (buffer holding the bytes, offset of this buffer's slot 0 in them) """
+        if self._target == None:
+            return self, 0
+        root, offset = self._target.resolve()
+        self._target = root
+        self._offset += offset
+        return root, self._offset
+
+    def getColours(self):
+        """ The bytes and the offset of this buffer's slot 0 in them """
+        root, offset = self.resolve()
+        return root._colours, offset
+
+    def mergeInto(self, other):
+        """ Append these colours to other's and view them there """
+        root = self.resolve()[0]
+        target = other.resolve()[0]
+        if root is target:
+            return
+        root._offset = len(target._colours)
+        target._colours.extend(root._colours)
+        root._colours = None
+        root._target = target
+
+
+
 class Bead(object):
     
-    def __init__(self, colour):
-        self._colour = colour
+    """ A bead is a view of one byte (slot) of a colour buffer, shared with
+        the other beads of its necklace or state, so changing its colour
+        changes the buffer. Bead(colour) makes a bead with a buffer of its
+        own. Beads are equal when they are views of the same byte (their
+        hash changes if their buffer is merged into another).
+        owner: IntersectedNecklacesState whose buffer this is, refreshed
+               (see _pack) when the colour is set """
+    __slots__ = ('_buffer', '_slot', '_owner')
+    
+    def __init__(self, colour=0, buffer=None, slot=0, owner=None):
+        if buffer == None:
+            buffer = ColourBuffer(bytearray([colour]))
+        self._buffer = buffer
+        self._slot = slot
+        self._owner = owner
+
+    def _byte(self):
+        """ (bytes, index) of this bead's colour """
+        colours, offset = self._buffer.getColours()
+        return colours, offset + self._slot
 
     def getColour(self):
-        return self._colour
+        colours, i = self._byte()
+        return colours[i]
     
     def setColour(self, colour):
-        self._colour = colour
+        colours, i = self._byte()
+        colours[i] = colour
+        if self._owner != None:
+            self._owner._pack()
+
+    def __eq__(self, o):
+        if not isinstance(o, Bead):
+            return False
+        colours, i = self._byte()
+        oColours, oi = o._byte()
+        return colours is oColours and i == oi
+
+    def __hash__(self):
+        colours, i = self._byte()
+        return hash((id(colours), i))
 
     def __str__(self):
-        return "\u001b[38;5;"+str(self._colour)+"mO\u001b[0m"
+        return "\u001b[38;5;"+str(self.getColour())+"mO\u001b[0m"
 
 
 
@@ -23,17 +112,31 @@ class Necklace(object):
     
     """ necklace: necklace to clone
         colourBeadsDist: quick and dirty way to initialize a necklace with a 
-                         distribution of coloured beads using a dictionary"""
-    def __init__(self, necklace=None, colourBeadsDist={1:10,2:9,3:1}):
+                         distribution of coloured beads using a dictionary
+        buffer, slots: make the necklace a view of the bytes slots (in bead
+                       order) of the ColourBuffer buffer, such as the one
+                       of an IntersectedNecklacesState
+        owner: that IntersectedNecklacesState, refreshed (see _pack) when
+               colours are changed through the necklace or its beads """
+    __slots__ = ('_numBeads', '_buffer', '_slots', '_owner')
+    
+    def __init__(self, necklace=None, colourBeadsDist={1:10,2:9,3:1}, buffer=None, slots=None, owner=None):
             
-        if necklace != None:
-            raise NotImplementedError
+        self._owner = None
+        if buffer != None:
+            self._buffer = buffer
+            self._slots = list(slots)
+            self._owner = owner
         else:
-            self._numBeads = sum(colourBeadsDist.values())
-            self._beads = [];
-            for k in colourBeadsDist.keys():
-                for i in range(colourBeadsDist[k]):
-                    self._beads.append(Bead(k));
+            if necklace != None:
+                colours = bytearray(necklace.getBeadColours())
+            else:
+                colours = bytearray()
+                for k in colourBeadsDist.keys():
+                    colours += bytes([k]) * colourBeadsDist[k]
+            self._buffer = ColourBuffer(colours)
+            self._slots = list(range(len(colours)))
+        self._numBeads = len(self._slots)
 
 
     def randomizeColors(self):
@@ -49,15 +152,16 @@ class Necklace(object):
 
 
     def getBead(self, k):
-        return self._beads[k]
+        return Bead(buffer=self._buffer, slot=self._slots[k], owner=self._owner)
     
     
     def getBeads(self):
-        return self._beads
+        return [Bead(buffer=self._buffer, slot=s, owner=self._owner) for s in self._slots]
 
 
     def getBeadColours(self):
-        return [b.getColour() for b in self._beads]
+        colours, offset = self._buffer.getColours()
+        return [colours[offset + s] for s in self._slots]
     
     
     def getBeadColourDistribution(self):
@@ -71,22 +175,49 @@ class Necklace(object):
 
     def removeBead(self, k):
         if (isinstance(k, int)):
-            self._beads.pop(k)
+            self._slots.pop(k)
             self._numBeads -= 1
             return
         if (isinstance(k, Bead)):
-            self._beads.remove(k)
-            self.numBeads -= 1
+            root, offset = self._buffer.resolve()
+            kRoot, kOffset = k._buffer.resolve()
+            if kRoot is not root:
+                raise ValueError("bead not in necklace")
+            self._slots.remove(kOffset + k._slot - offset)
+            self._numBeads -= 1
             return
         raise Exception("k is neither [int] or [Bead]!")
 
 
+    def _slotOf(self, bead):
+        """ Slot of bead in this necklace's buffer. To share a bead of
+            another buffer, this necklace's buffer is merged into that one
+            (see ColourBuffer.mergeInto), so the necklaces and beads already
+            sharing beads with it keep doing so. Beads of a state's buffer
+            cannot be shared that way. """
+        root = self._buffer.resolve()[0]
+        beadRoot, beadOffset = bead._buffer.resolve()
+        if root is not beadRoot:
+            if self._owner != None or bead._owner != None:
+                raise Exception("Cannot share beads between a state and another buffer")
+            self._buffer.mergeInto(bead._buffer)
+        # view the merged bytes directly, so that slots are in bead's frame
+        root, offset = self._buffer.resolve()
+        if root is not self._buffer:
+            self._slots = [offset + s for s in self._slots]
+            self._buffer = root
+        return beadOffset + bead._slot
+
+
     def appendBead(self, bead):
-        self.beads.append(bead)
+        slot = self._slotOf(bead)
+        self._slots.append(slot)
+        self._numBeads += 1
 
 
     def insertBead(self, i, bead):
-        self._beads.insert(i, bead)
+        slot = self._slotOf(bead)
+        self._slots.insert(i, slot)
         self._numBeads += 1
 
 
@@ -98,22 +229,361 @@ class Necklace(object):
     """ Rotate colours in given direction (negative = clockwise)
         direction: integer giving magnitude of rotation"""
     def rotateColours(self, direction):
-        if (direction < 0):
-            for k in range(-direction):
-                colours = [b.getColour() for b in self._beads]
-                colours = colours[1:self._numBeads]+[colours[0]]
-                for i in range(self._numBeads):
-                    self._beads[i].setColour(colours[i])
-        else:
-            for k in range(direction):
-                colours = [b.getColour() for b in self._beads]
-                colours = [colours[-1]] + colours[0:self._numBeads-1]
-                for i in range(self._numBeads):
-                    self._beads[i].setColour(colours[i])
+        k = direction % self._numBeads
+        if k == 0:
+            return
+        colours = self.getBeadColours()
+        colours = colours[-k:] + colours[:-k]
+        buffer, offset = self._buffer.getColours()
+        for i in range(self._numBeads):
+            buffer[offset + self._slots[i]] = colours[i]
+        if self._owner != None:
+            self._owner._pack()
 
 
     def __str__(self):
-        return "".join([str(x) for x in self._beads])+"\u001b[0m"
+        return "".join([str(x) for x in self.getBeads()])+"\u001b[0m"
+
+
+
+class NecklaceTopology(object):
+    
+    """ Layout of the beads of a set of intersected necklaces, computed once
+        per (dimension, numBeads) and shared by all states with that shape.
+        Unique beads are numbered (slots) in IntersectedNecklacesState
+        getOrderedBeads() order, so a state can be stored as a flat colour
+        array and each rotation applied as a single index permutation. """
+    def __init__(self, dimension, numBeads):
+        self._dimension = dimension
+        self._numBeads = numBeads
+        intersection = int(numBeads/4) - 2
+        leftNecklace_k = int(numBeads/2) + intersection + 1
+        leftNecklace_j = leftNecklace_k - intersection - 1
+        rightNecklace_k = 0
+        rightNecklace_j = intersection + 1
+        
+        self._slots = []
+        numSlots = 0
+        for i in range(dimension):
+            slots = [None for j in range(numBeads)]
+            if i > 0:
+                slots[rightNecklace_j] = self._slots[i-1][leftNecklace_j]
+                slots[rightNecklace_k] = self._slots[i-1][leftNecklace_k]
+            for j in range(numBeads):
+                if slots[j] == None:
+                    slots[j] = numSlots
+                    numSlots += 1
+            self._slots.append(tuple(slots))
+        self._numSlots = numSlots
+        self._slotSets = [set(slots) for slots in self._slots]
+        self._positions = [() for s in range(numSlots)]
+        for i in range(dimension):
+            for j in range(numBeads):
+                self._positions[self._slots[i][j]] += ((i, j),)
+        self._rotations = {}
+        self._screen = None
+        
+        # positions of necklace i shared with necklace m, and positions
+        # whose run start (colour differs from previous bead) may change
+        # when necklace m rotates
+        self._shared = {}
+        self._runPositions = {}
+        for i in range(dimension):
+            for m in (i-1, i+1):
+                if m < 0 or m >= dimension:
+                    continue
+                mSlots = self._slotSets[m]
+                shared = tuple(j for j in range(numBeads) if self._slots[i][j] in mSlots)
+                self._shared[(i, m)] = shared
+                self._runPositions[(i, m)] = tuple(sorted(set(shared) | set((j+1) % numBeads for j in shared)))
+        
+        self._numShared = [sum(len(shared) for (i, m), shared in self._shared.items() if i == k) \
+                           for k in range(dimension)]
+        
+        # mirror image: bead j of necklace i goes to bead (centre - j) of
+        # necklace dimension-1-i, which maps left shared positions onto
+        # right shared ones and vice versa
+        centre = leftNecklace_k
+        perm = list(range(numSlots))
+        for i in range(dimension):
+            for j in range(numBeads):
+                perm[self._slots[dimension-1-i][(centre - j) % numBeads]] = self._slots[i][j]
+        self._mirror = operator.itemgetter(*perm)
+
+
+    def getDimension(self):
+        return self._dimension
+
+
+    def getNumBeads(self):
+        return self._numBeads
+
+
+    def getNumSlots(self):
+        return self._numSlots
+
+
+    def getSlots(self, iNecklace):
+        """ Flat indices of the beads of necklace iNecklace, in bead order """
+        return self._slots[iNecklace]
+
+
+    def getSlot(self, iNecklace, position):
+        """ Flat index of bead position of necklace iNecklace """
+        return self._slots[iNecklace][position]
+
+
+    def getPositions(self, slot):
+        """ (necklace, position) pairs holding the bead of slot: two for
+            shared beads, one otherwise """
+        return self._positions[slot]
+
+
+    def mirror(self, packed):
+        """ Packed colours of the mirror image of the chain: necklace i
+            becomes necklace dimension-1-i, read in the opposite direction,
+            so that shared beads stay shared. Rotating necklace i by d in
+            a state is rotating dimension-1-i by -d in its mirror image. """
+        return bytes(self._mirror(packed))
+
+
+    def getSharedPositions(self, iNecklace, mNecklace):
+        """ Positions of necklace iNecklace whose beads mNecklace also has """
+        return self._shared[(iNecklace, mNecklace)]
+
+
+    def getNumSharedPositions(self, iNecklace):
+        """ Number of beads of necklace iNecklace shared with its neighbours """
+        return self._numShared[iNecklace]
+
+
+    def getRunPositions(self, iNecklace, mNecklace):
+        """ Shared positions with mNecklace and the positions following them """
+        return self._runPositions[(iNecklace, mNecklace)]
+
+
+    def rotation(self, iNecklace, direction):
+        """ Permutation p such that rotating necklace iNecklace by direction
+            turns a flat colour array old into new[x] = old[p[x]].
+            Any magnitude of rotation is a single table. """
+        return self._rotationTable(iNecklace, direction)[0]
+
+
+    def rotate(self, packed, iNecklace, direction):
+        """ Rotate a packed (bytes) colour array, returning a new one """
+        return bytes(self._rotationTable(iNecklace, direction)[1](packed))
+
+
+    def getScreen(self):
+        """ Layout of the text drawing of a state: for each line, the slot
+            of the bead drawn at each column (None for blanks). Computed on
+            first use. """
+        if self._screen == None:
+            height = int(self._numBeads/4)
+            length = int((self._numBeads - 2*height) / 2)
+            scrLength = length + 1
+            fullLength = scrLength * self._dimension + 4
+            scr = [ [None for i in range(fullLength)] for j in range(height+2) ]
+            for i in range(self._dimension):
+                for j in range(self._numBeads):
+                    # transform from (i,j) to scr (<l>ine, <c>olumn)
+                    if (j < 1):
+                        l = 1 + j
+                        c = i * scrLength + 1
+                    elif (j < height-1):
+                        l = 1 + j
+                        c = i * scrLength
+                    elif (j < height):
+                        l = height
+                        c = i * scrLength + 1
+                    elif (j < height+length):
+                        l = height + 1
+                        c = i * scrLength + (j-length) + 2
+                    elif (j < height+length+1):
+                        l = height
+                        c = i * scrLength + length + 2
+                    elif (j < height+length+height-1):
+                        l = height - (j - (height+length))
+                        c = i * scrLength + length + 3
+                    elif (j < height+length+height):
+                        l = height - (j - (height+length))
+                        c = i * scrLength + length + 2
+                    else:
+                        l = 0
+                        c = i * scrLength + length - (j - (height+length+height)) + 1
+                    scr[l][c] = self._slots[i][j]
+            self._screen = [tuple(line) for line in scr]
+        return self._screen
+
+
+    def render(self, colours, plain=False):
+        """ Text drawing of flat colours (packed or a colour buffer): ANSI
+            coloured beads, or with plain one character per colour code
+            (0-9, a-z, A-Z) """
+        beads = _PLAIN_BEADS if plain else _ANSI_BEADS
+        return "\n".join(["".join([" " if s == None else beads[colours[s]] for s in line])
+                          for line in self.getScreen()])
+
+
+    def listify(self, packed):
+        """ Packed colours as a list of necklace colour lists (listifyed()) """
+        return [[packed[s] for s in slots] for slots in self._slots]
+
+
+    def goalStates(self, cdist, upToRelabelling=False):
+        """ Generate the packed encodings of all goal states with colour
+            distribution cdist (colour -> number of beads). With
+            upToRelabelling, only goals where colours with the same number
+            of beads are used in increasing order, necklace by necklace, are
+            generated: at least one per class of goals equal up to renaming
+            those colours (see PuzzleColares.canonical), and far fewer.
+            In a goal each colour is complete in exactly one necklace, so each
+            necklace holds the runs of its two colours and every other bead
+            of it must be shared with a neighbour whose run covers it.
+            Necklaces are filled left to right, trying every pair of unused
+            colours, starting position of the first run and gap between runs
+            such that the beads outside the runs are shared ones. """
+        n = self._numBeads
+        shared = [set() for i in range(self._dimension)]
+        for (i, m), positions in self._shared.items():
+            shared[i].update(positions)
+        colours = sorted(cdist)
+        assign = [0 for x in range(self._numSlots)]
+        
+        def candidates(unused):
+            if not upToRelabelling:
+                return unused
+            # the smallest unused colour of each number of beads
+            first = {}
+            for c in unused:
+                first.setdefault(cdist[c], c)
+            return sorted(first.values())
+        
+        def place(i, unused):
+            if i == self._dimension:
+                if 0 not in assign:
+                    yield bytes(assign)
+                return
+            slots = self._slots[i]
+            for c1 in candidates(unused):
+                for c2 in candidates([c for c in unused if c != c1]):
+                    if c2 <= c1:
+                        continue
+                    a, b = cdist[c1], cdist[c2]
+                    free = n - a - b
+                    if free < 0:
+                        continue
+                    rest = [c for c in unused if c != c1 and c != c2]
+                    for start in range(n):
+                        for gap in range(free + 1):
+                            layout = [0 for j in range(n)]
+                            for k in range(a):
+                                layout[(start + k) % n] = c1
+                            for k in range(b):
+                                layout[(start + a + gap + k) % n] = c2
+                            changed = []
+                            for j in range(n):
+                                s = slots[j]
+                                if layout[j] == 0:
+                                    # covered by the left neighbour, or left
+                                    # for the right one to cover
+                                    if j not in shared[i] or (assign[s] == 0 and i > 0 and s in self._slotSets[i-1]):
+                                        break
+                                elif assign[s] == 0:
+                                    changed.append(s)
+                                elif assign[s] != layout[j]:
+                                    break
+                            else:
+                                for s in changed:
+                                    assign[s] = layout[slots.index(s)]
+                                for packed in place(i + 1, rest):
+                                    yield packed
+                                for s in changed:
+                                    assign[s] = 0
+        
+        for packed in place(0, colours):
+            yield packed
+
+
+    def _rotationTable(self, iNecklace, direction):
+        k = direction % self._numBeads
+        table = self._rotations.get((iNecklace, k))
+        if table == None:
+            perm = list(range(self._numSlots))
+            slots = self._slots[iNecklace]
+            for j in range(self._numBeads):
+                perm[slots[j]] = slots[(j - k) % self._numBeads]
+            perm = tuple(perm)
+            table = (perm, operator.itemgetter(*perm))
+            self._rotations[(iNecklace, k)] = table
+        return table
+
+
+
+class MultisetRanker(object):
+    
+    """ Perfect ranking of the arrangements of a fixed multiset of symbols
+        (bytes values): each arrangement gets a distinct integer in
+        [0, getSize()), in lexicographic order.
+        counts: dictionary symbol -> number of occurrences """
+    def __init__(self, counts):
+        self._symbols = sorted(counts)
+        self._index = {c: k for k, c in enumerate(self._symbols)}
+        self._counts = [counts[c] for c in self._symbols]
+        self._length = sum(self._counts)
+        self._size = math.factorial(self._length)
+        for c in self._counts:
+            self._size //= math.factorial(c)
+
+
+    def getSize(self):
+        return self._size
+
+
+    def rank(self, sequence):
+        counts = list(self._counts)
+        n = self._length
+        total = self._size
+        r = 0
+        for x in sequence:
+            k = self._index[x]
+            # arrangements of what is left that start with a smaller symbol
+            for j in range(k):
+                r += total * counts[j] // n
+            total = total * counts[k] // n
+            counts[k] -= 1
+            n -= 1
+        return r
+
+
+    def unrank(self, r):
+        counts = list(self._counts)
+        n = self._length
+        total = self._size
+        sequence = bytearray(n)
+        for i in range(self._length):
+            for k in range(len(counts)):
+                block = total * counts[k] // n
+                if r < block:
+                    break
+                r -= block
+            sequence[i] = self._symbols[k]
+            total = block
+            counts[k] -= 1
+            n -= 1
+        return bytes(sequence)
+
+
+
+_topologies = {}
+
+def getNecklaceTopology(dimension, numBeads):
+    """ Shared NecklaceTopology for the given puzzle shape """
+    topology = _topologies.get((dimension, numBeads))
+    if topology == None:
+        topology = NecklaceTopology(dimension, numBeads)
+        _topologies[(dimension, numBeads)] = topology
+    return topology
 
 
 
@@ -131,13 +601,28 @@ class IntersectedNecklacesState(object):
                 Example for two rings with 20 beads:
                 [[2,1,1,1,1,1,1,1,1,<3>,2,2,2,<2>,2,2,2,2,2,2],
                  [<2>,3,3,3,<3>,3,3,3,3,3,,3,4,4,4,4,4,4,4,4,4]]
-                shared beads are signaled for convenience """
+                shared beads are signaled for convenience
+        trusted: initConf is known to be valid (e.g. derived from another
+                 state), so skip the random generation and the tests
+        
+        The colours are kept in one buffer with a byte per unique bead (see
+        getPacked); necklaces and beads are views of it, made on demand. """
+    __slots__ = ('_dimension', '_numBeads', '_intersection', '_topology', '_buffer',
+                 '_packed', '_key', '_width', '_totals', '_counts', '_runs',
+                 '_complete', '_condensed', '_numOk')
                 
-    def __init__(self, dimension=2, numBeads=20, initConf=None):
+    def __init__(self, dimension=2, numBeads=20, initConf=None, trusted=False):
 
         self._dimension = dimension
         self._numBeads = numBeads
         self._intersection = int(numBeads/4) - 2
+        self._topology = getNecklaceTopology(dimension, numBeads)
+        
+        if trusted and initConf != None:
+            self._intersectNecklaces()
+            self._applyConfiguration(initConf)
+            self._pack()
+            return
             
         self._generateRandomConfiguration()
         
@@ -151,11 +636,7 @@ class IntersectedNecklacesState(object):
                     raise Exception("Wrong number of beads at "+str(l))
             
             # apply initConf
-            for i in range(self._dimension):
-                clist = initConf[i]
-                necklace = self._necklaces[i]
-                for j in range(self._numBeads):
-                    necklace.getBead(j).setColour(clist[j])
+            self._applyConfiguration(initConf)
             
             # further tests on initConf
             cdist = self.getColourDistribution()
@@ -166,21 +647,12 @@ class IntersectedNecklacesState(object):
             if (len([c for c in cdist.values() if c == int(self._numBeads/2)-1]) != 2*self._dimension-2):
                 raise Exception("Wrong colour distribution: "+str(cdist))
 
+        self._pack()
+
 
     def _generateRandomConfiguration(self):
-            # generate independent necklaces
-            self._necklaces = [Necklace(colourBeadsDist={1:self._numBeads}) for i in range(self._dimension)]
-            
             # intersect necklaces
-            for i in range(1,len(self._necklaces)):
-                leftNecklace = self._necklaces[i-1]
-                rightNecklace = self._necklaces[i]
-                leftNecklace_k = int(self._numBeads/2) + self._intersection + 1
-                leftNecklace_j = leftNecklace_k - self._intersection - 1
-                rightNecklace_k = 0
-                rightNecklace_j = self._intersection + 1
-                rightNecklace.replaceBead(rightNecklace_j, leftNecklace.getBead(leftNecklace_j))
-                rightNecklace.replaceBead(rightNecklace_k, leftNecklace.getBead(leftNecklace_k))
+            self._intersectNecklaces()
             
             # randomize colours
             numColours = self._dimension * 2
@@ -191,143 +663,333 @@ class IntersectedNecklacesState(object):
             for j in range(3, numColours+1):
                 colours += [j for i in range(cdim)]
             
-            beads = []
-            for necklace in self._necklaces:
-                for b in necklace.getBeads():
-                    if b not in beads:
-                        beads.append(b)
-            beads = list(beads)
+            s = len(self._buffer)
             while len(colours) > 0:
                 c = random.choice(colours)
                 colours.remove(c)
-                b = beads.pop()
-                b.setColour(c)
+                s -= 1
+                self._buffer[s] = c
+
+
+    def _intersectNecklaces(self):
+        """ Allocate the colour buffer, where adjacent necklaces share the
+            bytes of their intersection beads (see NecklaceTopology) """
+        self._buffer = bytearray([1]) * self._topology.getNumSlots()
+
+
+    def _applyConfiguration(self, initConf):
+        for i in range(self._dimension):
+            clist = initConf[i]
+            slots = self._topology.getSlots(i)
+            for j in range(self._numBeads):
+                self._buffer[slots[j]] = clist[j]
+
+
+    def _pack(self):
+        """ Refresh the packed encoding after the bead colours change """
+        self._packed = bytes(self._buffer)
+        self._key = self._packed
+        self._initGoalTracking()
+
+
+    def _initGoalTracking(self):
+        """ Count, for each necklace and colour, the beads and the runs
+            (maximal sequences) of that colour. A colour is complete in a
+            necklace when it holds all beads of that colour, and condensed
+            when it is also a single run. A necklace is solved when it has
+            exactly two complete colours and both are condensed. """
+        packed = self._packed
+        width = max(packed) + 1
+        self._width = width
+        self._totals = [packed.count(c) for c in range(width)]
+        self._counts = bytearray(self._dimension * width)
+        self._runs = bytearray(self._dimension * width)
+        self._complete = bytearray(self._dimension)
+        self._condensed = bytearray(self._dimension)
+        self._numOk = 0
+        for i in range(self._dimension):
+            base = i * width
+            slots = self._topology.getSlots(i)
+            previous = packed[slots[-1]]
+            for s in slots:
+                c = packed[s]
+                self._counts[base + c] += 1
+                if c != previous:
+                    self._runs[base + c] += 1
+                previous = c
+            for c in set(packed):
+                if self._counts[base + c] == self._totals[c]:
+                    self._complete[i] += 1
+                    if self._runs[base + c] == 1:
+                        self._condensed[i] += 1
+            if self._complete[i] == 2 and self._condensed[i] == 2:
+                self._numOk += 1
+
+
+    def _trackRotation(self, old, new, iNecklace):
+        """ Update the goal counts after necklace iNecklace was rotated from
+            packed colours old to new. The rotated necklace keeps its cyclic
+            colour sequence; only the beads its neighbours share with it
+            change, so only those (and the runs next to them) are visited. """
+        width = self._width
+        totals = self._totals
+        counts = self._counts
+        runs = self._runs
+        for m in (iNecklace-1, iNecklace+1):
+            if m < 0 or m >= self._dimension:
+                continue
+            slots = self._topology.getSlots(m)
+            shared = self._topology.getSharedPositions(m, iNecklace)
+            touched = self._topology.getRunPositions(m, iNecklace)
+            base = m * width
+            colours = set()
+            for q in touched:
+                colours.add(old[slots[q]])
+                colours.add(new[slots[q]])
+            
+            wasOk = self._complete[m] == 2 and self._condensed[m] == 2
+            complete = self._complete[m]
+            condensed = self._condensed[m]
+            for c in colours:
+                if counts[base + c] == totals[c]:
+                    complete -= 1
+                    if runs[base + c] == 1:
+                        condensed -= 1
+            for q in touched:
+                c = old[slots[q]]
+                if c != old[slots[q-1]]:
+                    runs[base + c] -= 1
+            for p in shared:
+                counts[base + old[slots[p]]] -= 1
+                counts[base + new[slots[p]]] += 1
+            for q in touched:
+                c = new[slots[q]]
+                if c != new[slots[q-1]]:
+                    runs[base + c] += 1
+            for c in colours:
+                if counts[base + c] == totals[c]:
+                    complete += 1
+                    if runs[base + c] == 1:
+                        condensed += 1
+            self._complete[m] = complete
+            self._condensed[m] = condensed
+            
+            isOk = complete == 2 and condensed == 2
+            if isOk != wasOk:
+                self._numOk += 1 if isOk else -1
+
+
+    def clone(self):
+        """ Copy of this state that shares no beads with it. Skips the random
+            generation and the configuration tests of the constructor. The
+            clone has no colour buffer: it is made from the packed encoding
+            only if the clone's beads are asked for (see _colours). """
+        state = IntersectedNecklacesState.__new__(IntersectedNecklacesState)
+        state._dimension = self._dimension
+        state._numBeads = self._numBeads
+        state._intersection = self._intersection
+        state._topology = self._topology
+        state._buffer = None
+        state._packed = self._packed
+        state._key = self._key
+        state._width = self._width
+        state._totals = self._totals
+        state._counts = self._counts[:]
+        state._runs = self._runs[:]
+        state._complete = self._complete[:]
+        state._condensed = self._condensed[:]
+        state._numOk = self._numOk
+        return state
+
+
+    def getDimension(self):
+        return self._dimension
+
+
+    def getNumBeads(self):
+        return self._numBeads
+
+
+    def _colours(self):
+        """ The colour buffer, made from the packed encoding if needed """
+        if self._buffer == None:
+            self._buffer = bytearray(self._packed)
+        return self._buffer
 
 
     def getNecklaces(self):
-        return self._necklaces
+        """ Necklaces viewing this state's colours. Changing colours through
+            them (or their beads) refreshes the state's key and goal counts. """
+        buffer = ColourBuffer(self._colours())
+        return [Necklace(buffer=buffer, slots=self._topology.getSlots(i), owner=self) for i in range(self._dimension)]
+
+
+    def getPacked(self):
+        """ Immutable encoding of the state: one byte (colour code) per unique
+            bead, in getOrderedBeads() order. Used for hashing and equality. """
+        return self._packed
+
+
+    def getTopology(self):
+        return self._topology
+
+
+    def getKey(self):
+        """ Value used for hashing and equality: the packed encoding, unless
+            a canonical one was set (see PuzzleColares symmetry) """
+        return self._key
+
+
+    def setKey(self, key):
+        """ Make this state equal to all states with the same key. Reset to
+            the packed encoding by rotateColours. """
+        self._key = key
 
 
     def rotateColours(self, iNecklace, direction):
-        self._necklaces[iNecklace].rotateColours(direction)
+        packed = self._topology.rotate(self._packed, iNecklace, direction)
+        if self._buffer != None:
+            self._buffer[:] = packed
+        self._trackRotation(self._packed, packed, iNecklace)
+        self._packed = packed
+        self._key = packed
 
 
     def getOrderedBeads(self):
-        orderedBeads = []
-        for necklace in self._necklaces:
-            for b in necklace.getBeads():
-                if b not in orderedBeads:
-                    orderedBeads.append(b)
-        return orderedBeads
+        """ Unique beads, necklace by necklace, indexed by topology slot """
+        buffer = ColourBuffer(self._colours())
+        return [Bead(buffer=buffer, slot=s, owner=self) for s in range(self._topology.getNumSlots())]
 
 
     def getOrderedBeadColours(self):
-        return [b.getColour() for b in self.getOrderedBeads()]
+        return list(self._colours())
 
 
     def getColourDistribution(self):
-        allBeadColours = self.getOrderedBeadColours()
-        colourSet = set(allBeadColours)
-        cdist = {}
-        for c in colourSet:
-            cdist[c] = allBeadColours.count(c)
-        return cdist
+        buffer = self._colours()
+        return {c: buffer.count(c) for c in sorted(set(buffer))}
 
 
     def i_am_a_goal_state(self):
         """Goal is attained when each necklace has two colours condensed 
-        in full sequences (complete set)."""
-        # get colour distributions
-        scdist = self.getColourDistribution()
-        for necklace in self.getNecklaces():
-            ncdist = necklace.getBeadColourDistribution()
-            # must have at least two complete colours
-            completeColours = [c for c in ncdist.keys() if scdist[c] == ncdist[c]]
-            if len(completeColours) != 2:
-                return False
-                    
-        # all have two complete colours
-        # now lets test for full sequences
-        for necklace in self.getNecklaces():
-            nbColours = necklace.getBeadColours()
-            ncdist = necklace.getBeadColourDistribution()
-            completeColours = [c for c in ncdist.keys() if scdist[c] == ncdist[c]]
-            for c in completeColours:
-                ic = nbColours.index(c)
-                ccount = 1
-                niter = 0
-                iup = ic
-                idown = ic
-                while (nbColours[iup] == c or nbColours[idown] == c):
-                    niter += 1
-                    iup = (ic + niter) % len(nbColours)
-                    idown = (ic - niter) % len(nbColours)
-                    if nbColours[iup] == c:
-                        ccount += 1
-                    if nbColours[idown] == c:
-                        ccount += 1
-                if ccount != scdist[c]:
-                    return False
-        # all have two complete colours in full sequence
-        return True
+        in full sequences (complete set).
+        Uses the counts kept up to date by rotateColours, so it is O(1)."""
+        return self._numOk == self._dimension
 
 
-    def __str__(self):
-        height = self._intersection + 2
-        length = int((self._numBeads - 2*height) / 2)
-        scrLength = length + 1
-        fullLength = scrLength * self._dimension + 4
-        
-        # blank screen buffer
-        scr = [ [" " for i in range(fullLength)] for j in range(height+2) ]
-        
+    def runsHeuristic(self):
+        """ Lower bound on the moves to a goal from the number of runs.
+            A solved necklace has its two runs plus, at most, one run per
+            bead it shares with its neighbours. Rotating a necklace does not
+            change its own runs and changes two beads of each neighbour,
+            which adds or removes at most 4 runs there (8 in total). """
+        width = self._width
+        worst = 0
+        excess = 0
         for i in range(self._dimension):
-            necklace = self._necklaces[i]
-            for j in range(self._numBeads):
-                bead = necklace.getBead(j)
-                # transform from (i,j) to scr (<l>ine, <c>olumn)
-                if (j < 1):
-                    l = 1 + j
-                    c = i * scrLength + 1
-                elif (j < height-1):
-                    l = 1 + j
-                    c = i * scrLength
-                elif (j < height):
-                    l = height
-                    c = i * scrLength + 1
-                elif (j < height+length):
-                    l = height + 1
-                    c = i * scrLength + (j-length) + 2
-                elif (j < height+length+1):
-                    l = height
-                    c = i * scrLength + length + 2
-                elif (j < height+length+height-1):
-                    l = height - (j - (height+length))
-                    c = i * scrLength + length + 3
-                elif (j < height+length+height):
-                    l = height - (j - (height+length))
-                    c = i * scrLength + length + 2
-                else:
-                    l = 0
-                    c = i * scrLength + length - (j - (height+length+height)) + 1
-                scr[l][c] = str(bead)
-        return "\n".join(["".join(line) for line in scr])
-    
-    
-    """ Only compares colour values, not the bead objetcs themselves"""
+            base = i * width
+            runs = 0
+            for c in range(width):
+                runs += self._runs[base + c]
+            e = runs - 2 - self._topology.getNumSharedPositions(i)
+            if e > 0:
+                worst = max(worst, e)
+                excess += e
+        return max(-(-worst // 4), -(-excess // 8))
+
+
+    def misplacedHeuristic(self):
+        """ Lower bound on the moves to a goal from misplaced beads. Each
+            colour must end up complete in some necklace, missing at least
+            the beads it misses in the necklace where it has the most.
+            A move changes two beads of each neighbour of the rotated
+            necklace, so it brings at most 2 beads of a colour into a
+            necklace (4 beads in total). """
+        width = self._width
+        worst = 0
+        missing = 0
+        for c in range(width):
+            total = self._totals[c]
+            if total == 0:
+                continue
+            most = 0
+            for base in range(c, self._dimension * width, width):
+                most = max(most, self._counts[base])
+            worst = max(worst, total - most)
+            missing += total - most
+        return max(-(-worst // 2), -(-missing // 4))
+
+
+    def render(self, plain=False):
+        """ Text drawing of the state (see NecklaceTopology.render) """
+        return self._topology.render(self._buffer if self._buffer != None else self._packed, plain)
+
+
+    def __str__(self):
+        return self.render()
+    
+    
+    """ Compares keys (see getKey): the colour values, or the canonical
+        forms when PuzzleColares symmetry set them"""
     def __eq__(self, o):
-        return tuple(self.getOrderedBeadColours()) == tuple(o.getOrderedBeadColours())
+        return isinstance(o, IntersectedNecklacesState) and self._key == o._key
+
+
+    def __hash__(self):
+        return hash(self._key)
+
+
+    """ Arbitrary but consistent order, so that nodes with equal priority can
+        be compared in a PriorityQueue"""
+    def __lt__(self, o):
+        return self._key < o._key
 
 
     def listifyed(self):
-        return [[b.getColour() for b in necklace.getBeads()] for necklace in self._necklaces]
+        return self._topology.listify(self._colours())
 
 
 
 class PuzzleColares(Problem):
     
-    def __init__(self, initial, goal=None):
+    """ symmetry: when True, states are keyed by their canonical form (see
+                  canonical), so searches treat symmetric states as
+                  duplicates. Solutions are unaffected: nodes keep the
+                  actual states. This pays off in the searches that start
+                  from the goals: bidirectional_breadth_first_search and
+                  ScrambleGenerator start from one goal per class of
+                  symmetric goals and keep 8 times fewer states on 2 x 20,
+                  96 times fewer on 3 x 20. A search from one scramble
+                  rarely reaches a symmetric copy of a state it has seen,
+                  so the searches that go through result gain little and
+                  pay for canonical on every state. The batch, bitset and
+                  parallel breadth-first searches, buildPatternDatabase and
+                  buildDistanceTable ignore it.
+        prune:    when True, successor_actions skips the moves that cannot
+                  be on a shortest solution after the node's last move (see
+                  successor_actions). Meant for tree searches
+                  (breadth_first_tree_search, depth_limited_search,
+                  iterative_deepening_search, and
+                  iterative_deepening_astar_search with table_size=0): a
+                  graph search may discard the only node from which a
+                  pruned move was allowed. """
+    def __init__(self, initial, goal=None, symmetry=False, prune=False):
         super().__init__(initial, goal)
+        self.symmetry = symmetry
+        self.prune = prune
+        self._ranker = None
+        if prune:
+            # pairs of necklaces sharing no beads, whose rotations commute
+            topology = initial.getTopology()
+            slots = [set(topology.getSlots(i)) for i in range(initial.getDimension())]
+            self._commuting = set((i, m) for i in range(len(slots)) for m in range(len(slots)) \
+                                  if i != m and not slots[i] & slots[m])
+        if symmetry:
+            # colours with the same number of beads are interchangeable
+            cdist = initial.getColourDistribution()
+            self._labels = {c: tuple(sorted(k for k in cdist if cdist[k] == cdist[c])) for c in cdist}
+            self.initial = initial.clone()
+            self.initial.setKey(self.canonical(self.initial))
 
 
     def actions(self, state):
@@ -335,21 +997,60 @@ class PuzzleColares(Problem):
         state. The result would typically be a list, but if there are
         many actions, consider yielding them one at a time in an
         iterator, rather than building them all at once."""
-        return [{'name':'rotate', 'target':i, 'direction':+1, 'cost':1} for i in range(len(state.getNecklaces()))] + \
-               [{'name':'rotate', 'target':i, 'direction':-1, 'cost':1} for i in range(len(state.getNecklaces()))]
+        return [{'name':'rotate', 'target':i, 'direction':+1, 'cost':1} for i in range(state.getDimension())] + \
+               [{'name':'rotate', 'target':i, 'direction':-1, 'cost':1} for i in range(state.getDimension())]
+
+
+    def successor_actions(self, node):
+        """ actions(node.state), without (when prune is on) the moves that
+            some other sequence of moves makes redundant after node.action:
+            its inverse; a move on a necklace sharing no beads with the last
+            one moved and numbered before it (those moves commute, so only
+            the ascending order is tried); and repeating the last move when
+            that would rotate the necklace more than half a turn, that is
+            more than numBeads//2 times by +1 or (numBeads-1)//2 times by -1
+            (the opposite direction is as short or shorter). """
+        actions = self.actions(node.state)
+        last = node.action
+        if not self.prune or last == None:
+            return actions
+        target, direction = last['target'], last['direction']
+        run = 1
+        parent = node.parent
+        while parent.action != None and parent.action['target'] == target \
+                and parent.action['direction'] == direction:
+            run += 1
+            parent = parent.parent
+        numBeads = node.state.getNumBeads()
+        maxRun = numBeads // 2 if direction > 0 else (numBeads - 1) // 2
+        successors = []
+        for action in actions:
+            i = action['target']
+            if i == target:
+                if action['direction'] != direction or run >= maxRun:
+                    continue
+            elif i < target and (i, target) in self._commuting:
+                continue
+            successors.append(action)
+        return successors
 
 
     def result(self, state, action):
         """Return the state that results from executing the given
         action in the given state. The action must be one of
         self.actions(state)."""
-        newState = IntersectedNecklacesState(dimension=len(state.getNecklaces()), \
-                        numBeads=state.getNecklaces()[0].getNumBeads(), \
-                        initConf=state.listifyed())
+        newState = state.clone()
         newState.rotateColours(iNecklace=action['target'], direction=action['direction'])
+        if self.symmetry:
+            newState.setKey(self.canonical(newState))
         return newState
     
     
+    def state_key(self, state):
+        """ Immutable copy of state, equal for the states it is equal to """
+        return state.getKey()
+
+
     def path_cost(self, c, state1, action, state2):
         """Return the cost of a solution path that arrives at state2 from
         state1 via action, assuming cost c to get up to state1. If the problem
@@ -359,6 +1060,20 @@ class PuzzleColares(Problem):
         return c + action['cost']
 
 
+    def h(self, node):
+        """ Admissible heuristic: the best of the closed-form bounds of the
+            state (see IntersectedNecklacesState.runsHeuristic and
+            misplacedHeuristic). The bounds are weak: on scrambles at known
+            depths it was at most 2 on 2 x 8 (depths up to 12), 3 x 8 and
+            2 x 12, and 1 to 3 on 2 x 20 (depths 3 to 7), averaging under
+            2. astar_search with it expanded 1.25 to 1.4 times as many
+            nodes as breadth_first_search on 2 x 8 at depths 6 to 10, so it
+            is no faster. A PatternDatabase (see pdbColares) of colours 1
+            and 2 gave 6 to 10 at depth 10 there. """
+        state = node.state
+        return max(state.runsHeuristic(), state.misplacedHeuristic())
+
+
     def goal_test(self, state):
         """Return True if the state is a goal. The default method compares the
         state to self.goal or checks for state in self.goal if it is a
@@ -372,6 +1087,433 @@ class PuzzleColares(Problem):
         print(state)
 
 
+    def canonical(self, state):
+        """ Canonical representative of the states equivalent to state for
+            the goal: relabelling colours with the same number of beads, and
+            the mirror image of the chain. Colours are renamed in order of
+            first appearance, and the smaller of the encodings of state and
+            its mirror image is returned. """
+        return self.canonicalPacked(state.getPacked())
+
+
+    def canonicalPacked(self, packed):
+        """ canonical for a packed state of the puzzle """
+        mirrored = self.initial.getTopology().mirror(packed)
+        return min(self._relabel(packed), self._relabel(mirrored))
+
+
+    def _relabel(self, packed):
+        table = bytearray(range(256))
+        used = {}
+        for c in dict.fromkeys(packed):
+            labels = self._labels[c]
+            k = used.get(labels, 0)
+            table[c] = labels[k]
+            used[labels] = k + 1
+        return packed.translate(table)
+
+
+    def getRanker(self):
+        """ MultisetRanker numbering every arrangement of the colours of the
+            initial state, i.e. every state of the puzzle """
+        if self._ranker == None:
+            self._ranker = MultisetRanker(self.initial.getColourDistribution())
+        return self._ranker
+
+
+    def numStates(self):
+        return self.getRanker().getSize()
+
+
+    def rank(self, state):
+        """ Distinct integer in [0, numStates()) for state """
+        return self.getRanker().rank(state.getPacked())
+
+
+    def unrank(self, r):
+        """ State numbered r by rank """
+        topology = self.initial.getTopology()
+        return IntersectedNecklacesState(topology.getDimension(), topology.getNumBeads(), \
+                                         initConf=topology.listify(self.getRanker().unrank(r)), trusted=True)
+
+
+    def goalStates(self):
+        """ All goal states with the colour distribution of the initial state """
+        topology = self.initial.getTopology()
+        for packed in topology.goalStates(self.initial.getColourDistribution()):
+            yield IntersectedNecklacesState(topology.getDimension(), topology.getNumBeads(), \
+                                            initConf=topology.listify(packed), trusted=True)
+
+
+    def batchActions(self, state):
+        """ Actions of state and a (number of actions x number of slots)
+            NumPy array whose rows are their slot permutations """
+        topology = state.getTopology()
+        actions = self.actions(state)
+        perms = np.array([topology.rotation(a['target'], a['direction']) for a in actions], dtype=np.intp)
+        return actions, perms
+
+
+    def expandBatch(self, layer, perms):
+        """ Successors of a layer of packed states (2-D uint8 array, one
+            state per row) with a single gather. Row r*len(perms)+a of the
+            result is action a applied to row r of layer. """
+        return layer[:, perms].reshape(-1, layer.shape[1])
+
+
+    def goalTestBatch(self, layer, topology, cdist):
+        """ Boolean array telling which rows of layer are goal states.
+            cdist is the colour distribution of the puzzle states. """
+        ok = np.ones(len(layer), dtype=bool)
+        for i in range(topology.getDimension()):
+            beads = layer[:, topology.getSlots(i)]
+            previous = np.roll(beads, 1, axis=1)
+            complete = np.zeros(len(layer), dtype=np.int8)
+            condensed = np.zeros(len(layer), dtype=np.int8)
+            for c, total in cdist.items():
+                isColour = beads == c
+                isComplete = isColour.sum(axis=1) == total
+                runs = (isColour & (previous != c)).sum(axis=1)
+                complete += isComplete
+                condensed += isComplete & (runs == 1)
+            ok &= (complete == 2) & (condensed == 2)
+        return ok
+
+
+
+def _replay(problem, path):
+    """ Goal Node reached from problem.initial by the actions of path. The
+        states are rotated directly, not through problem.result, so the
+        rebuilding of a solution found on packed states is neither counted
+        nor stopped by a node budget again (see Problem.count) """
+    node = Node(problem.initial)
+    for action in path:
+        state = node.state.clone()
+        state.rotateColours(iNecklace=action['target'], direction=action['direction'])
+        node = Node(state, node, action, problem.path_cost(node.path_cost, node.state, action, state))
+    return node
+
+
+def batch_breadth_first_search(problem):
+    """Breadth-first search over a PuzzleColares one whole layer at a time.
+    Each layer is a 2-D NumPy array of packed states, expanded with a single
+    gather, goal tested and deduplicated in bulk. As rotations are
+    invertible, a new state can only repeat one of the previous or the
+    current layer, so only those two are kept. Returns the goal Node, built
+    by replaying the actions found, as the other searches do."""
+    if np is None:
+        raise ImportError("batch_breadth_first_search requires NumPy")
+    node = Node(problem.initial)
+    if problem.goal_test(node.state):
+        return node
+    
+    actions, perms = problem.batchActions(problem.initial)
+    topology = problem.initial.getTopology()
+    cdist = problem.initial.getColourDistribution()
+    rowType = np.dtype((np.void, topology.getNumSlots()))
+    layer = np.frombuffer(problem.initial.getPacked(), dtype=np.uint8).reshape(1, -1)
+    layerKeys = layer.view(rowType).ravel()
+    previousKeys = layerKeys[:0]
+    # for each layer, index of the first (row * number of actions + action)
+    # of the previous layer that generated each of its states
+    history = []
+    while len(layer):
+        children = problem.expandBatch(layer, perms)
+        problem.count(len(layer), len(children))
+        keys, first = np.unique(children.view(rowType).ravel(), return_index=True)
+        new = ~np.isin(keys, layerKeys) & ~np.isin(keys, previousKeys)
+        keys = keys[new]
+        first = first[new]
+        history.append(first)
+        children = children[first]
+        goals = np.flatnonzero(problem.goalTestBatch(children, topology, cdist))
+        if len(goals):
+            path = []
+            row = goals[0]
+            for first in reversed(history):
+                row, a = divmod(int(first[row]), len(actions))
+                path.append(actions[a])
+            return _replay(problem, reversed(path))
+        previousKeys, layerKeys, layer = layerKeys, keys, children
+    return None
+
+
+def bitset_breadth_first_search(problem, maxStates=2**34):
+    """Breadth-first search that numbers states with PuzzleColares.rank, so
+    the visited set is an array with two bits per state of the puzzle,
+    holding 0 for a state not reached yet and otherwise 1 + its depth
+    modulo 3. Only the layer being expanded and the next one are kept, as
+    arrays of ranks. Goals are recognised by rank too (see
+    PuzzleColares.goalStates). The solution is rebuilt by walking back from
+    the goal: the neighbours of a state at depth d are at depth d-1, d or
+    d+1, so the parent is the neighbour marked with depth d-1.
+    Memory is problem.numStates() / 4 bytes (about 1 MB for 2 necklaces of
+    8 beads, 38 GB for 12 beads) plus 8 bytes per state of the two layers.
+    Puzzles with more than maxStates states (4 GiB by default; None for no
+    limit) are refused with an exception before allocating."""
+    node = Node(problem.initial)
+    if problem.goal_test(node.state):
+        return node
+    ranker = problem.getRanker()
+    if maxStates != None and ranker.getSize() > maxStates:
+        raise Exception("Too many states for the visited array: "+str(ranker.getSize())+" > maxStates="+str(maxStates))
+    topology = problem.initial.getTopology()
+    actions = problem.actions(problem.initial)
+    moves = [(a['target'], a['direction']) for a in actions]
+    goals = set(ranker.rank(g) for g in topology.goalStates(problem.initial.getColourDistribution()))
+    typecode = 'Q' if ranker.getSize() <= 2**64 else None
+    
+    def newLayer(ranks=()):
+        return array.array(typecode, ranks) if typecode else list(ranks)
+    
+    # four states per byte, two bits each
+    visited = bytearray((ranker.getSize() + 3) // 4)
+    
+    def depthMark(r):
+        return (visited[r >> 2] >> ((r & 3) << 1)) & 3
+    
+    start = ranker.rank(problem.initial.getPacked())
+    visited[start >> 2] |= 1 << ((start & 3) << 1)
+    layer = newLayer([start])
+    depth = 0
+    while layer:
+        depth += 1
+        mark = depth % 3 + 1
+        nextLayer = newLayer()
+        for r in layer:
+            packed = ranker.unrank(r)
+            problem.count(1, len(moves))
+            for i, d in moves:
+                child = topology.rotate(packed, i, d)
+                c = ranker.rank(child)
+                if depthMark(c):
+                    continue
+                visited[c >> 2] |= mark << ((c & 3) << 1)
+                if c in goals:
+                    # walk back: some opposite rotation leads one layer up
+                    path = []
+                    while depth > 0:
+                        depth -= 1
+                        for a, (i, d) in enumerate(moves):
+                            parent = topology.rotate(child, i, -d)
+                            if depthMark(ranker.rank(parent)) == depth % 3 + 1:
+                                path.append(actions[a])
+                                child = parent
+                                break
+                    return _replay(problem, reversed(path))
+                nextLayer.append(c)
+        layer = nextLayer
+    return None
+
+
+
+def _shardOf(packed, numShards):
+    # crc32 rather than hash(), which is salted differently in each process
+    return zlib.crc32(packed) % numShards
+
+
+def _breadthFirstShard(connection, inboxes, shard, numShards, dimension, numBeads, moves, goals):
+    """ Worker of parallel_breadth_first_search owning the states of one
+        shard. For each layer it keeps the new candidate states of its shard
+        (with their parent and action) and expands them, stopping at the
+        first goal generated. It puts the successors owned by each other
+        worker in that worker's inbox queue, takes the candidates of the
+        next layer from its own, and answers the master with the goal found
+        (goal, parent, action index) or None, the number of states expanded
+        and the number of candidates for the next layer. """
+    topology = getNecklaceTopology(dimension, numBeads)
+    visited = {}
+    incoming = []
+    while True:
+        message = connection.recv()
+        if message[0] == 'layer':
+            incoming.extend(message[1])
+            buckets = [[] for k in range(numShards)]
+            found = None
+            expanded = 0
+            for packed, parent, a in incoming:
+                if packed in visited:
+                    continue
+                visited[packed] = (parent, a)
+                expanded += 1
+                for b, (i, d) in enumerate(moves):
+                    child = topology.rotate(packed, i, d)
+                    if child in goals:
+                        found = (child, packed, b)
+                        break
+                    buckets[_shardOf(child, numShards)].append((child, packed, b))
+                if found != None:
+                    break
+            for k in range(numShards):
+                if k != shard:
+                    inboxes[k].put(buckets[k])
+            incoming = buckets[shard]
+            for k in range(numShards - 1):
+                incoming.extend(inboxes[shard].get())
+            connection.send((found, expanded, len(incoming)))
+        elif message[0] == 'parent':
+            connection.send(visited[message[1]])
+        else:
+            connection.close()
+            return
+
+
+def parallel_breadth_first_search(problem, workers=None):
+    """Breadth-first search for PuzzleColares spread over worker processes.
+    States are split into shards by a hash of their packed encoding and each
+    worker owns one shard: it removes duplicates, remembers parents and
+    expands the new states of its shard, testing for goals as it generates
+    them. Between layers the workers send each other their successors
+    directly, one bulk message per pair of workers; the master process only
+    starts each layer and collects the goal found. Returns the goal Node,
+    built by replaying the actions found, like breadth_first_search."""
+    node = Node(problem.initial)
+    if problem.goal_test(node.state):
+        return node
+    workers = workers or multiprocessing.cpu_count()
+    topology = problem.initial.getTopology()
+    actions = problem.actions(problem.initial)
+    moves = [(a['target'], a['direction']) for a in actions]
+    goals = set(topology.goalStates(problem.initial.getColourDistribution()))
+    
+    connections = []
+    processes = []
+    inboxes = [multiprocessing.Queue() for k in range(workers)]
+    for shard in range(workers):
+        mine, theirs = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_breadthFirstShard, \
+                        args=(theirs, inboxes, shard, workers, topology.getDimension(), topology.getNumBeads(), moves, goals))
+        process.daemon = True
+        process.start()
+        connections.append(mine)
+        processes.append(process)
+    
+    try:
+        start = problem.initial.getPacked()
+        first = [[] for k in range(workers)]
+        first[_shardOf(start, workers)].append((start, None, None))
+        found = None
+        candidates = 1
+        while found == None and candidates > 0:
+            for connection, layer in zip(connections, first):
+                connection.send(('layer', layer))
+            first = [[] for k in range(workers)]
+            expanded = candidates = 0
+            for connection in connections:
+                goal, n, size = connection.recv()
+                if goal != None:
+                    found = goal
+                expanded += n
+                candidates += size
+            problem.count(expanded, expanded * len(moves))
+        if found == None:
+            return None
+        
+        goal, packed, b = found
+        path = [actions[b]]
+        while True:
+            connection = connections[_shardOf(packed, workers)]
+            connection.send(('parent', packed))
+            packed, a = connection.recv()
+            if packed == None:
+                break
+            path.append(actions[a])
+        return _replay(problem, reversed(path))
+    finally:
+        for connection in connections:
+            connection.send(('stop',))
+        for process in processes:
+            process.join()
+
+
+
+def bidirectional_breadth_first_search(problem):
+    """Bidirectional breadth-first search for PuzzleColares. The backward
+    search starts from every goal state (see PuzzleColares.goalStates) and
+    uses the opposite rotations; both directions keep hashed dictionaries of
+    packed states and the smaller frontier is expanded a whole layer at a
+    time, so the first meeting gives a shortest solution. Returns the goal
+    Node, built by replaying the actions found.
+    With PuzzleColares symmetry, both directions key states by their
+    canonical form and the backward search starts from one goal per class
+    of symmetric goals. Where the directions meet on two symmetric states,
+    the backward half of the solution is mapped through the symmetry
+    (colour renamings commute with rotations; the mirror image turns the
+    rotation of necklace i by d into that of dimension-1-i by -d)."""
+    node = Node(problem.initial)
+    topology = problem.initial.getTopology()
+    actions = problem.actions(problem.initial)
+    moves = [(a['target'], a['direction']) for a in actions]
+    opposite = [moves.index((i, -d)) for i, d in moves]
+    mirrored = [moves.index((topology.getDimension()-1-i, -d)) for i, d in moves]
+    canonical = problem.canonicalPacked if problem.symmetry else None
+    
+    # key -> (key of the state it was reached from, action index, packed
+    # state), where the key is the packed state or its canonical form
+    start = problem.initial.getPacked()
+    startKey = start if canonical == None else canonical(start)
+    forward = {startKey: (None, None, start)}
+    backward = {}
+    for goal in topology.goalStates(problem.initial.getColourDistribution(), upToRelabelling=problem.symmetry):
+        backward.setdefault(goal if canonical == None else canonical(goal), (None, None, goal))
+    if startKey in backward:
+        return node
+    
+    def expand(layer, visited, other):
+        nextLayer = []
+        for key in layer:
+            packed = visited[key][2]
+            problem.count(1, len(moves))
+            for a, (i, d) in enumerate(moves):
+                child = topology.rotate(packed, i, d)
+                childKey = child if canonical == None else canonical(child)
+                if childKey not in visited:
+                    visited[childKey] = (key, a, child)
+                    if childKey in other:
+                        return nextLayer, childKey
+                    nextLayer.append(childKey)
+        return nextLayer, None
+    
+    forwardLayer = [startKey]
+    backwardLayer = list(backward)
+    while forwardLayer and backwardLayer:
+        if len(forwardLayer) <= len(backwardLayer):
+            forwardLayer, meet = expand(forwardLayer, forward, backward)
+        else:
+            backwardLayer, meet = expand(backwardLayer, backward, forward)
+        if meet != None:
+            path = []
+            key = meet
+            while forward[key][0] != None:
+                key, a, packed = forward[key]
+                path.append(a)
+            path.reverse()
+            # the backward states are those of the meeting state's mirror
+            # image when they are not one of its colour renamings
+            reflect = canonical != None and \
+                      problem._relabel(forward[meet][2]) != problem._relabel(backward[meet][2])
+            key = meet
+            while backward[key][0] != None:
+                key, a, packed = backward[key]
+                path.append(mirrored[opposite[a]] if reflect else opposite[a])
+            return _replay(problem, [actions[a] for a in path])
+    return None
+
+
+
+def writeSolution(node, stream=None, plain=False):
+    """ Write the states on the path from the root to node, each after the
+        action that reached it, to stream (standard output by default) in a
+        single write """
+    parts = []
+    for n in node.path():
+        if n.action != None:
+            parts.append(str(n.action))
+        parts.append(n.state.render(plain))
+        parts.append("")
+    (stream or sys.stdout).write("\n".join(parts))
+
+
 def exec(p,estado,accoes):
     """ Executa uma sequência de acções a partir do estado
         devolve um par (estado, custo) depois de imprimir
@@ -501,4 +1643,15 @@ if __name__ == "__main__":
         print(a)
     print ("cost = "+str(resultNode.path_cost))
     
-    
\ No newline at end of file
+    print()
+    print("Performing bit-array breadth-first search on two rings with 8 beads...")
+    print()
+    instate = IntersectedNecklacesState(dimension=2, numBeads=8)
+    print(instate)
+    resultNode = bitset_breadth_first_search(PuzzleColares(instate))
+    if resultNode == None:
+        print("No solution")
+    else:
+        print("Final state:")
+        print(resultNode.state)
+        print ("cost = "+str(resultNode.path_cost))
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+""" Seeded PuzzleColares instances at an exact optimal distance from a goal.
+
+ScrambleGenerator runs a breadth-first search from all goal states up to
+depth-1 moves, keeping every state closer than depth. An instance is then
+one random move away from a random state at distance depth-1, accepted only
+if it is not among the closer states, so its optimal solution has exactly
+depth moves. Each instance costs a rotation and a set lookup (or a batch of
+NumPy gathers and one np.isin when NumPy is installed).
+
+The closer states are kept in memory: about 32 * 3**(depth-1) of them on a
+2 x 20 puzzle, so depths up to 10 or 11 are practical there. With --symmetry
+only their canonical forms are kept (see PuzzleColares symmetry), 8 times
+fewer there and 96 times fewer on 3 x 20.
+
+Instances are written as JSONL (one listifyed() configuration per line, the
+input format of batchColares.py) or as raw packed rows:
+
+    python scrambleColares.py --beads 20 --depth 8 --count 100000 -o scrambles.jsonl
+"""
+
+import argparse
+import json
+import random
+import sys
+from puzzleColares import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class ScrambleGenerator(object):
+
+    """ Generator of instances of problem (a PuzzleColares; only the shape
+        and colours of its initial state matter) whose optimal solution has
+        exactly depth moves. With the same seed the same instances are
+        produced (for a given NumPy availability).
+        With problem symmetry, the closer states are kept by canonical form
+        (see PuzzleColares.canonical), starting from one goal per class of
+        symmetric goals, so there are far fewer of them; each instance is
+        then given a random renaming of the colours with the same number of
+        beads and, half of the time, mirrored. The NumPy batches are not
+        used in that case. """
+    def __init__(self, problem, depth, seed=None):
+        initial = problem.initial
+        self._topology = initial.getTopology()
+        self._depth = depth
+        self._moves = [(a['target'], a['direction']) for a in problem.actions(initial)]
+        self._random = random.Random(seed)
+        self._canonical = problem.canonicalPacked if problem.symmetry else None
+        self._rng = np.random.default_rng(seed) if np != None and not problem.symmetry else None
+        cdist = initial.getColourDistribution()
+        self._classes = [[c for c in cdist if cdist[c] == n] for n in sorted(set(cdist.values()))]
+
+        # layer by layer from the goals, up to distance depth-1
+        key = self._key
+        layer = {}
+        for packed in self._topology.goalStates(cdist, upToRelabelling=problem.symmetry):
+            layer.setdefault(key(packed), packed)
+        layer = list(layer.values())
+        closer = set(key(packed) for packed in layer)
+        for d in range(1, depth):
+            nextLayer = []
+            for packed in layer:
+                for i, k in self._moves:
+                    child = self._topology.rotate(packed, i, k)
+                    childKey = key(child)
+                    if childKey not in closer:
+                        closer.add(childKey)
+                        nextLayer.append(child)
+            layer = nextLayer
+        if depth > 0 and not any(key(self._topology.rotate(packed, i, k)) not in closer \
+                                 for packed in layer for i, k in self._moves):
+            raise Exception("No state is "+str(depth)+" moves from a goal: depth is beyond the largest distance of this puzzle")
+        self._closer = closer
+        self._layer = layer
+
+        if self._rng != None and depth > 0:
+            numSlots = self._topology.getNumSlots()
+            self._rowType = np.dtype((np.void, numSlots))
+            self._layerArray = np.frombuffer(b''.join(layer), dtype=np.uint8).reshape(-1, numSlots)
+            self._closerKeys = np.sort(np.frombuffer(b''.join(closer), dtype=self._rowType))
+            self._perms = np.array([self._topology.rotation(i, k) for i, k in self._moves], dtype=np.intp)
+
+
+    def getDepth(self):
+        return self._depth
+
+
+    def _key(self, packed):
+        return packed if self._canonical == None else self._canonical(packed)
+
+
+    def _disguise(self, packed):
+        """ packed with the colours of each number of beads renamed at
+            random and, half of the time, mirrored """
+        table = bytearray(range(256))
+        for colours in self._classes:
+            for c, renamed in zip(colours, self._random.sample(colours, len(colours))):
+                table[c] = renamed
+        packed = packed.translate(table)
+        if self._random.random() < 0.5:
+            packed = self._topology.mirror(packed)
+        return packed
+
+
+    def _checkCount(self, count):
+        if count < 0:
+            raise ValueError("Negative number of instances: "+str(count))
+
+
+    def generate(self, count):
+        """ List of count packed states at distance depth """
+        self._checkCount(count)
+        if count == 0:
+            return []
+        if self._depth == 0:
+            instances = [self._random.choice(self._layer) for n in range(count)]
+        elif self._rng != None:
+            return [row.tobytes() for row in self.generateArray(count)]
+        else:
+            instances = []
+            while len(instances) < count:
+                i, k = self._random.choice(self._moves)
+                child = self._topology.rotate(self._random.choice(self._layer), i, k)
+                if self._key(child) not in self._closer:
+                    instances.append(child)
+        if self._canonical != None:
+            instances = [self._disguise(packed) for packed in instances]
+        return instances
+
+
+    def generateArray(self, count):
+        """ (count x number of slots) uint8 NumPy array of packed states at
+            distance depth, one per row """
+        if np == None:
+            raise ImportError("generateArray requires NumPy")
+        self._checkCount(count)
+        if count == 0:
+            return np.empty((0, self._topology.getNumSlots()), dtype=np.uint8)
+        if self._depth == 0 or self._rng == None:
+            return np.frombuffer(b''.join(self.generate(count)), dtype=np.uint8).reshape(count, -1)
+        batches = []
+        missing = count
+        while missing > 0:
+            size = max(missing * 2, 1024)
+            rows = self._layerArray[self._rng.integers(len(self._layerArray), size=size)]
+            perms = self._perms[self._rng.integers(len(self._perms), size=size)]
+            children = np.take_along_axis(rows, perms, axis=1)
+            keys = children.view(self._rowType).ravel()
+            children = children[~np.isin(keys, self._closerKeys)][:missing]
+            batches.append(children)
+            missing -= len(children)
+        return np.concatenate(batches)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate PuzzleColares instances at an exact optimal depth")
+    parser.add_argument('--dimension', type=int, default=2)
+    parser.add_argument('--beads', type=int, default=20)
+    parser.add_argument('--depth', type=int, required=True)
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('-o', '--output', default='-', help="JSONL file (default: standard output)")
+    parser.add_argument('--binary', action='store_true', help="write raw packed rows instead of JSONL")
+    parser.add_argument('--symmetry', action='store_true', help="keep the closer states by canonical form")
+    args = parser.parse_args()
+
+    puzzle = PuzzleColares(IntersectedNecklacesState(dimension=args.dimension, numBeads=args.beads), symmetry=args.symmetry)
+    generator = ScrambleGenerator(puzzle, args.depth, args.seed)
+    instances = generator.generate(args.count)
+    topology = puzzle.initial.getTopology()
+    if args.binary:
+        sink = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        sink.write(b''.join(instances))
+    else:
+        sink = sys.stdout if args.output == '-' else open(args.output, 'w')
+        for packed in instances:
+            sink.write(json.dumps(topology.listify(packed)) + "\n")
+    if args.output != '-':
+        sink.close()
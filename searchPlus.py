@@ -6,11 +6,12 @@ functions."""
 
 from utils import (
     is_in, argmin, argmax, argmax_random_tie, probability, weighted_sampler,
-    memoize, print_table, open_data, Stack, FIFOQueue, PriorityQueue, name,
-    distance
+    memoize, print_table, open_data, Stack, FIFOQueue, HashedFIFOQueue,
+    PriorityQueue, name, distance
 )
 
-from collections import defaultdict
+import array
+from collections import defaultdict, deque
 import math
 import random
 import sys
@@ -42,6 +43,12 @@ class Problem(object):
         iterator, rather than building them all at once."""
         raise NotImplementedError
 
+    def successor_actions(self, node):
+        """Return the actions to try when expanding node. The default is
+        all of self.actions(node.state); override it to skip actions that
+        the path to node (node.action, node.parent) makes redundant."""
+        return self.actions(node.state)
+
     def result(self, state, action):
         """Return the state that results from executing the given
         action in the given state. The action must be one of
@@ -66,6 +73,19 @@ class Problem(object):
         and action. The default method costs 1 for every step in the path."""
         return c + 1
 
+    def state_key(self, state):
+        """Return a hashable value, equal for equal states, that graph
+        searches keep to recognise states already seen. The default is the
+        state itself; override this method if states are not hashable."""
+        return state
+
+    def count(self, expanded, generated):
+        """Called by searches that expand states without calling actions
+        and result, with the number of states they expanded and generated.
+        The default does nothing; InstrumentedProblem adds them to its
+        statistics."""
+        pass
+
     def value(self, state):
         """For optimization problems, each state has a value.  Hill-climbing
         and related algorithms try to maximize this value."""
@@ -83,7 +103,10 @@ class Node:
     the total path_cost (also known as g) to reach the node.  Other functions
     may add an f and h value; see best_first_graph_search and astar_search for
     an explanation of how the f and h values are handled. You will not need to
-    subclass this class."""
+    subclass this class. Nodes have __slots__, so f and h are the only
+    attributes that can be added (see SearchTree for a smaller store)."""
+
+    __slots__ = ('state', 'parent', 'action', 'path_cost', 'depth', 'f', 'h')
 
     def __init__(self, state, parent=None, action=None, path_cost=0):
         """Create a search tree Node, derived from a parent by an action."""
@@ -104,7 +127,7 @@ class Node:
     def expand(self, problem):
         """List the nodes reachable in one step from this node."""
         return [self.child_node(problem, action)
-                for action in problem.actions(self.state)]
+                for action in problem.successor_actions(self)]
 
     def child_node(self, problem, action):
         """[Figure 3.10]"""
@@ -136,6 +159,54 @@ class Node:
     def __hash__(self):
         return hash(self.state)
 
+
+class SearchTree:
+
+    """A search tree kept in parallel typed arrays instead of Nodes: node i
+    has parent index parents[i] (-1 for the root, node 0), action index
+    actions[i], the position of its action in problem.actions(state of the
+    parent), and path cost costs[i], about 18 bytes per node. States are
+    not stored; node(i) rebuilds the Nodes of the path to node i by
+    replaying the actions from problem.initial."""
+
+    def __init__(self, problem):
+        self.problem = problem
+        self.parents = array.array('q', [-1])
+        self.actions = array.array('H', [0])
+        self.costs = array.array('d', [0])
+
+    def add(self, parent, action, path_cost):
+        """Add a child of node parent, reached by the action at index action
+        of the parent's actions, and return its index."""
+        self.parents.append(parent)
+        self.actions.append(action)
+        self.costs.append(path_cost)
+        return len(self.parents) - 1
+
+    def __len__(self):
+        return len(self.parents)
+
+    def action_indices(self, index):
+        """The action indices on the path from the root to node index."""
+        indices = []
+        while self.parents[index] >= 0:
+            indices.append(self.actions[index])
+            index = self.parents[index]
+        return list(reversed(indices))
+
+    def node(self, index):
+        """The Node of node index, with its parents up to the root."""
+        node = Node(self.problem.initial)
+        for a in self.action_indices(index):
+            node = node.child_node(self.problem, self.problem.actions(node.state)[a])
+        return node
+
+    def solution(self, index):
+        return self.node(index).solution()
+
+    def path(self, index):
+        return self.node(index).path()
+
 # ______________________________________________________________________________
 
 
@@ -191,22 +262,30 @@ def tree_search(problem, frontier):
     return None
 
 
-def graph_search(problem, frontier):
+def graph_search(problem, frontier, key=None):
     """Search through the successors of a problem to find a goal.
     The argument frontier should be an empty queue.
-    If two paths reach a state, only use the first one. [Figure 3.7]"""
-    frontier.append(Node(problem.initial))
-    explored = list()
+    If two paths reach a state, only use the first one. [Figure 3.7]
+    The explored states and the states in the frontier are kept in sets, by
+    key(state): a hashable value equal for equal states, by default
+    problem.state_key(state)."""
+    key = key or problem.state_key
+    node = Node(problem.initial)
+    frontier.append(node)
+    in_frontier = {key(node.state)}
+    explored = set()
     while frontier:
         node = frontier.pop()
+        state_key = key(node.state)
+        in_frontier.discard(state_key)
         if problem.goal_test(node.state):
             return node
-        zz = []
-        #explored.append(node.state)
-        explored = explored + [node.state]
-        frontier.extend(child for child in node.expand(problem)
-                        if child.state not in explored and
-                        child not in frontier)
+        explored.add(state_key)
+        for child in node.expand(problem):
+            state_key = key(child.state)
+            if state_key not in explored and state_key not in in_frontier:
+                frontier.append(child)
+                in_frontier.add(state_key)
     return None
 
 
@@ -221,9 +300,9 @@ def depth_first_tree_search(problem):
     return tree_search(problem, Stack())
 
 
-def depth_first_graph_search(problem):
+def depth_first_graph_search(problem, key=None):
     """Search the deepest nodes in the search tree first."""
-    return graph_search(problem, Stack())
+    return graph_search(problem, Stack(), key)
 
 def depth_first_graph_search_count(problem):
     """Search the deepest nodes in the search tree first."""
@@ -235,20 +314,44 @@ def breadth_first_search(problem):
     node = Node(problem.initial)
     if problem.goal_test(node.state):
         return node
-    frontier = FIFOQueue()
+    frontier = HashedFIFOQueue(key=lambda node: problem.state_key(node.state))
     frontier.append(node)
     explored = set()
     while frontier:
         node = frontier.pop()
-        explored.add(node.state)
+        explored.add(problem.state_key(node.state))
         for child in node.expand(problem):
-            if child.state not in explored and child not in frontier:
+            if problem.state_key(child.state) not in explored and child not in frontier:
                 if problem.goal_test(child.state):
                     return child
                 frontier.append(child)
     return None
 
 
+def compact_breadth_first_search(problem):
+    """breadth_first_search keeping the search tree in a SearchTree: the
+    frontier holds (state, index) pairs, and Nodes are only made for the
+    path to the goal. Uses problem.actions, not successor_actions."""
+    tree = SearchTree(problem)
+    if problem.goal_test(problem.initial):
+        return tree.node(0)
+    frontier = deque([(problem.initial, 0)])
+    reached = {problem.state_key(problem.initial)}
+    while frontier:
+        state, index = frontier.popleft()
+        g = tree.costs[index]
+        for a, action in enumerate(problem.actions(state)):
+            child = problem.result(state, action)
+            state_key = problem.state_key(child)
+            if state_key not in reached:
+                reached.add(state_key)
+                child_index = tree.add(index, a, problem.path_cost(g, state, action, child))
+                if problem.goal_test(child):
+                    return tree.node(child_index)
+                frontier.append((child, child_index))
+    return None
+
+
 def best_first_graph_search(problem, f):
     """Search the nodes with the lowest f scores first.
     You specify the function f(node) that you want to minimize; for example,
@@ -256,27 +359,41 @@ def best_first_graph_search(problem, f):
     first search; if f is node.depth then we have breadth-first search.
     There is a subtlety: the line "f = memoize(f, 'f')" means that the f
     values will be cached on the nodes as they are computed. So after doing
-    a best first search you can examine the f values of the path returned."""
+    a best first search you can examine the f values of the path returned.
+    The best node found for each state (by problem.state_key), in the
+    frontier or explored, is kept in a dict. A child with a lower f replaces
+    it, in O(log n); if the state was already explored it is reopened and
+    expanded again, which only happens when f can decrease along a path
+    (e.g. A* with an inconsistent heuristic). Such re-expansions are
+    counted in problem.reexpansions when the problem has that attribute,
+    as InstrumentedProblem does."""
     f = memoize(f, 'f')
     node = Node(problem.initial)
     if problem.goal_test(node.state):
         return node
-    frontier = PriorityQueue(min, f)
+    frontier = PriorityQueue(min, f, key=lambda node: problem.state_key(node.state))
     frontier.append(node)
-    explored = list()
+    best = {problem.state_key(node.state): node}
+    explored = set()
     while frontier:
         node = frontier.pop()
         if problem.goal_test(node.state):
             return node
-        explored.append(node.state)
+        state_key = problem.state_key(node.state)
+        if state_key in explored and hasattr(problem, 'reexpansions'):
+            problem.reexpansions += 1
+        explored.add(state_key)
         for child in node.expand(problem):
-            if child.state not in explored and child not in frontier:
+            state_key = problem.state_key(child.state)
+            incumbent = best.get(state_key)
+            if incumbent is None:
+                best[state_key] = child
                 frontier.append(child)
-            elif child in frontier:
-                incumbent = frontier[child]
-                if f(child) < f(incumbent):
+            elif f(child) < f(incumbent):
+                if incumbent in frontier:
                     del frontier[incumbent]
-                    frontier.append(child)
+                best[state_key] = child
+                frontier.append(child)
     return None
 
 
@@ -412,6 +529,19 @@ def astar_search(problem, h=None):
     h = memoize(h or problem.h, 'h')
     return best_first_graph_search(problem, lambda n: n.path_cost + h(n))
 
+
+def max_heuristic(*heuristics):
+    """Combine admissible heuristics h(node) into one that returns the
+    largest of their values, which is still admissible."""
+    def h(node):
+        best = 0
+        for heuristic in heuristics:
+            value = heuristic(node)
+            if value > best:
+                best = value
+        return best
+    return h
+
 # ______________________________________________________________________________
 # Other search algorithms
 
@@ -448,6 +578,73 @@ def recursive_best_first_search(problem, h=None):
     return result
 
 
+def iterative_deepening_astar_search(problem, h=None, table_size=2**16):
+    """IDA*: depth-first searches of the nodes with f = g + h(node) up to a
+    bound, which starts at h(initial) and is raised to the smallest f that
+    exceeded it until a goal is found. The depth-first search uses an
+    explicit stack, so memory is O(depth) plus the transposition table: a
+    list of table_size (problem.state_key(state), g, iteration) entries,
+    indexed by hash, that prunes a node already searched in the same
+    iteration with a path cost no larger (0 disables it). A new entry
+    replaces one from an earlier iteration, for the same state or with a
+    larger or equal g, since the subtrees below smaller g are larger.
+    Problems whose successor_actions depend on the path to the node need
+    table_size=0, as the node pruned may have had other actions left."""
+    h = h or problem.h
+    table = [None] * table_size if table_size > 0 else None
+    root = Node(problem.initial)
+    bound = h(root)
+    iteration = 0
+    while bound < infinity:
+        iteration += 1
+        smallest = infinity
+        stack = []
+        node = root
+        while True:
+            f = node.path_cost + h(node)
+            if f > bound:
+                smallest = min(smallest, f)
+                descend = False
+            elif problem.goal_test(node.state):
+                return node
+            elif table is None:
+                descend = True
+            else:
+                descend = _ida_record(table, problem.state_key(node.state), node.path_cost, iteration)
+            if descend:
+                stack.append((node, iter(list(problem.successor_actions(node)))))
+
+            # next action of the deepest node with actions left
+            action = None
+            while stack:
+                parent, actions = stack[-1]
+                action = next(actions, None)
+                if action is not None:
+                    break
+                stack.pop()
+            if not stack:
+                break
+            node = parent.child_node(problem, action)
+        bound = smallest
+    return None
+
+
+def _ida_record(table, key, g, iteration):
+    """False if key is in table with a path cost <= g from this iteration,
+    otherwise True, storing (key, g, iteration) by the replacement policy of
+    iterative_deepening_astar_search."""
+    slot = hash(key) % len(table)
+    entry = table[slot]
+    if entry is not None and entry[2] == iteration:
+        if entry[0] == key:
+            if entry[1] <= g:
+                return False
+        elif entry[1] < g:
+            return True
+    table[slot] = (key, g, iteration)
+    return True
+
+
 def hill_climbing(problem):
     """From the initial node, keep choosing the neighbor with highest value,
     stopping when no neighbor is better. [Figure 4.2]"""
@@ -1039,6 +1236,9 @@ class NQueensProblem(Problem):
         new[col] = row
         return new
 
+    def state_key(self, state):
+        return tuple(state)
+
     def conflicted(self, state, row, col):
         """Would placing a queen at (row, col) conflict with anything?"""
         return any(self.conflict(row, col, state[c], c)
@@ -1282,16 +1482,28 @@ class InstrumentedProblem(Problem):
     def __init__(self, problem):
         self.problem = problem
         self.succs = self.goal_tests = self.states = 0
+        self.reexpansions = 0
         self.found = None
 
     def actions(self, state):
         self.succs += 1
         return self.problem.actions(state)
 
+    def successor_actions(self, node):
+        self.succs += 1
+        return self.problem.successor_actions(node)
+
     def result(self, state, action):
         self.states += 1
         return self.problem.result(state, action)
 
+    def state_key(self, state):
+        return self.problem.state_key(state)
+
+    def count(self, expanded, generated):
+        self.succs += expanded
+        self.states += generated
+
     def goal_test(self, state):
         self.goal_tests += 1
         result = self.problem.goal_test(state)
@@ -8,6 +8,7 @@ import os.path
 import random
 import math
 import functools
+import heapq
 from itertools import chain, combinations
 
 
@@ -679,6 +680,7 @@ class Queue:
     """Queue is an abstract class/interface. There are three types:
         Stack(): A Last In First Out Queue.
         FIFOQueue(): A First In First Out Queue.
+        HashedFIFOQueue(): A FIFOQueue with O(1) membership tests.
         PriorityQueue(order, f): Queue in sorted order (default min-first).
     Each type supports the following methods and functions:
         q.append(item)  -- add an item to the queue
@@ -734,42 +736,106 @@ class FIFOQueue(Queue):
         return item in self.queue
 
 
+class HashedFIFOQueue(FIFOQueue):
+
+    """A First-In-First-Out Queue that also counts its items by key(item)
+    (by default the item itself, which must then be hashable) in a
+    Counter, so item in q takes O(1) instead of a scan of the queue."""
+
+    def __init__(self, maxlen=None, items=[], key=None):
+        super().__init__(maxlen, items)
+        self.key = key or (lambda x: x)
+        self.counts = collections.Counter(self.key(item) for item in self.queue)
+
+    def append(self, item):
+        super().append(item)
+        self.counts[self.key(item)] += 1
+
+    def extend(self, items):
+        if not self.queue.maxlen or len(self.queue) + len(items) <= self.queue.maxlen:
+            for item in items:
+                self.queue.append(item)
+                self.counts[self.key(item)] += 1
+        else:
+            raise Exception('FIFOQueue max length exceeded')
+
+    def pop(self):
+        item = super().pop()
+        k = self.key(item)
+        self.counts[k] -= 1
+        if self.counts[k] == 0:
+            del self.counts[k]
+        return item
+
+    def __contains__(self, item):
+        return self.key(item) in self.counts
+
+
+_removed = object()  # item of the PriorityQueue entries deleted
+
+
 class PriorityQueue(Queue):
 
     """A queue in which the minimum (or maximum) element (as determined by f and
     order) is returned first. If order is min, the item with minimum f(x) is
     returned first; if order is max, then it is the item with maximum f(x).
-    Also supports dict-like lookup."""
-
-    def __init__(self, order=min, f=lambda x: x):
-        self.A = []
+    Items with equal f(x) are returned in the order they were added.
+    Also supports dict-like lookup.
+
+    The items are kept in a binary heap of [priority, count, item] entries,
+    and in a dict from key(item) (by default the item itself, which must
+    then be hashable) to the entries of equal items, so append and pop are
+    O(log n) and in, [] and del are O(1). del only marks the entries as
+    removed, and pop skips them."""
+
+    def __init__(self, order=min, f=lambda x: x, key=None):
+        self.heap = []
+        self.entries = {}
         self.order = order
         self.f = f
+        self.key = key or (lambda x: x)
+        self.count = 0
+        self.size = 0
 
     def append(self, item):
-        bisect.insort(self.A, (self.f(item), item))
+        priority = self.f(item)
+        if self.order != min:
+            priority = -priority
+        entry = [priority, self.count, item]
+        self.count += 1
+        heapq.heappush(self.heap, entry)
+        self.entries.setdefault(self.key(item), []).append(entry)
+        self.size += 1
 
     def __len__(self):
-        return len(self.A)
+        return self.size
 
     def pop(self):
-        if self.order == min:
-            return self.A.pop(0)[1]
-        else:
-            return self.A.pop()[1]
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            item = entry[2]
+            if item is not _removed:
+                k = self.key(item)
+                same = self.entries[k]
+                same.remove(entry)
+                if not same:
+                    del self.entries[k]
+                self.size -= 1
+                return item
+        raise Exception('PriorityQueue is empty')
 
     def __contains__(self, item):
-        return any(item == pair[1] for pair in self.A)
+        return self.key(item) in self.entries
 
     def __getitem__(self, key):
-        for _, item in self.A:
-            if item == key:
-                return item
+        same = self.entries.get(self.key(key))
+        if same:
+            return min(same)[2]
 
     def __delitem__(self, key):
-        for i, (value, item) in enumerate(self.A):
-            if item == key:
-                self.A.pop(i)
+        for entry in self.entries.pop(self.key(key), []):
+            entry[2] = _removed
+            self.size -= 1
 
 
 # ______________________________________________________________________________